@@ -0,0 +1,106 @@
+"""Generates synthetic templates that stress one part of haiku each.
+
+    python benchmarks/corpus.py [scale] [directory]
+
+Every generator takes a ``size`` and returns the source of a template that
+grows linearly with it; ``corpus`` returns all of them for one ``scale``.
+Given a directory, the templates are written there as ``<name>.haml``.
+"""
+
+from __future__ import print_function
+import os
+import sys
+
+def deep(size):
+    """Elements nested ``size`` levels deep, with text at every level. Capped
+    at 250 levels, as rendering recurses once per level."""
+
+    lines = []
+
+    for depth in range(min(size, 250)):
+        indent = '  ' * depth
+        lines.append('%s%%div.level-%d' % (indent, depth))
+        lines.append('%s  %%span level %d' % (indent, depth))
+
+    return '\n'.join(lines)
+
+def wide(size):
+    """A list of ``size`` sibling items."""
+
+    lines = ['%ul.items']
+    lines.extend('  %%li.item item number %d' % i for i in range(size))
+    return '\n'.join(lines)
+
+def attributes(size):
+    """``size`` elements with an id, classes and a dict of attributes."""
+
+    lines = ['#links']
+
+    for i in range(size):
+        lines.append("  %%a#link-%d.button.button-%d{'href': '/items/%d', 'title': 'Item %d', "
+                     "'data-id': '%d', 'class': 'extra'} link %d" % (i, i % 10, i, i, i, i))
+
+    return '\n'.join(lines)
+
+def filters(size):
+    """A ``:plain`` and a ``:javascript`` filter of ``size`` lines each."""
+
+    lines = ['%div', '  :plain']
+    lines.extend('    plain line %d with <b>markup</b> & entities' % i for i in range(size))
+    lines.append('  :javascript')
+    lines.extend('    var value%d = compute(%d, "%d");' % (i, i, i) for i in range(size))
+    return '\n'.join(lines)
+
+def interpolation(size):
+    """``size`` lines interpolating several ``#{}`` expressions each."""
+
+    lines = ['%div']
+    lines.extend('  %%p Hello #{user}, item %d of #{count} is #{items[%d]} in #{place}' % (i, i)
+                 for i in range(size))
+    return '\n'.join(lines)
+
+def control(size):
+    """``size`` loops with conditionals and output, for the code targets."""
+
+    lines = ['%div']
+
+    for i in range(size):
+        lines.extend([
+            '  - for item in items%d' % i,
+            '    - if item',
+            '      %li= item',
+            '    - else',
+            '      %li.empty none',
+        ])
+
+    return '\n'.join(lines)
+
+GENERATORS = (
+    ('deep', deep, 50),
+    ('wide', wide, 1000),
+    ('attributes', attributes, 300),
+    ('filters', filters, 1000),
+    ('interpolation', interpolation, 500),
+    ('control', control, 200),
+)
+
+def corpus(scale=1):
+    """Returns ``(name, haml)`` for every generator at ``scale`` times its
+    default size."""
+
+    return [(name, generate(max(1, int(size * scale)))) for name, generate, size in GENERATORS]
+
+if __name__ == '__main__':
+    scale = float(sys.argv[1]) if len(sys.argv) > 1 else 1
+    directory = sys.argv[2] if len(sys.argv) > 2 else None
+
+    for name, haml in corpus(scale):
+        if directory is None:
+            print('%-14s %6d lines %8d bytes' % (name, haml.count('\n') + 1, len(haml)))
+            continue
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        with open(os.path.join(directory, name + '.haml'), 'w') as f:
+            f.write(haml)
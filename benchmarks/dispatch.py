@@ -0,0 +1,83 @@
+"""Measures how long it takes to pick the node class for a line of HAML.
+
+    python benchmarks/dispatch.py [lines]
+
+The registered dispatch table is compared against the linear scan over every
+operator that ``Node.create`` used to do.
+"""
+
+from __future__ import print_function
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from haiku import node as nodes
+
+LINES = [
+    '%div.container',
+    '#main',
+    '.item',
+    '- for item in items',
+    '- if item',
+    '= item.name',
+    '-# comment',
+    '/ html comment',
+    '!!! 5',
+    ':javascript',
+    'plain text in a paragraph',
+    'more plain text',
+    'and another line of text',
+    '\\- escaped',
+    '> stripped text',
+]
+
+def linear_classify(haml):
+    NODES = [
+        (nodes.HAMLComment, '-#'),
+        (nodes.HTMLCommentNode, '/'),
+        (nodes.HTMLNode, ('#', '.', '%')),
+        (nodes.CodeNode, '-'),
+        (nodes.EvalNode, ('=', '>=')),
+        (nodes.DoctypeNode, '!!!'),
+        (nodes.RawNode, ('\\', '>')),
+        (nodes.PlainFilterNode, ':plain'),
+        (nodes.JavaScriptFilterNode, ':javascript'),
+        (nodes.CssFilterNode, ':css'),
+        (nodes.CdataFilterNode, ':cdata'),
+        (nodes.EscapedFilterNode, ':escaped'),
+    ]
+
+    for cls, operators in NODES:
+        if not isinstance(operators, tuple):
+            operators = (operators,)
+
+        for operator in operators:
+            if haml.startswith(operator):
+                return cls
+
+    return nodes.RawNode
+
+def run(count=100000, repeat=5):
+    lines = (LINES * (count // len(LINES) + 1))[:count]
+
+    for line in LINES:
+        assert linear_classify(line) is nodes.Node.classify(line), line
+
+    results = {}
+
+    for name, classify in (('linear', linear_classify), ('dispatch', nodes.Node.classify)):
+        seconds = min(timeit.repeat(lambda: [classify(line) for line in lines], number=1, repeat=repeat))
+        results[name] = seconds / count * 1e9
+
+    return results
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    results = run(count)
+
+    for name in ('linear', 'dispatch'):
+        print('%-10s %8.1f ns/line' % (name, results[name]))
+
+    print('speedup    %8.1fx' % (results['linear'] / results['dispatch']))
@@ -0,0 +1,90 @@
+"""Compares rendering through Tornado templates with the native Python target.
+
+    python benchmarks/native.py [renders]
+
+The Tornado path compiles the template to Tornado syntax and has
+``tornado.template`` parse that again; the native path compiles the template
+straight into a Python function. Both the one-off compile and each render
+are timed. Tornado is optional; without it only the native path is timed.
+"""
+
+from __future__ import print_function
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from haiku import HAML, Tornado
+from haiku.cache import Cache
+from haiku.native import Template
+
+try:
+    import tornado.template
+except ImportError:
+    tornado = None
+
+TEMPLATE = '''\
+!!! 5
+%html
+  %head
+    %title= title
+  %body
+    #content.page
+      %h1 Hello #{user}
+      %ul.items
+        - for item in items
+          %li{'class': '=item["kind"]'}
+            %a{'href': '=item["url"]'}= item['name']
+            - if item['count'] > 1
+              %span.count= item['count']
+            - else
+              %span.single one
+      %p.footer
+        Rendered for #{user}
+'''
+
+CONTEXT = {
+    'title': 'Benchmark <page>',
+    'user': 'someone & co',
+    'items': [{'kind': 'k%d' % i, 'url': '/items/%d' % i, 'name': 'Item %d' % i, 'count': i % 3}
+              for i in range(50)],
+}
+
+def tornado_compile():
+    html = HAML(TEMPLATE, target=Tornado, cache=Cache()).to_html()
+    return tornado.template.Template(html)
+
+def native_compile():
+    return Template(TEMPLATE)
+
+def run(count=2000, repeat=5):
+    paths = [('native', native_compile, lambda template: template.render(CONTEXT))]
+
+    if tornado is not None:
+        paths.insert(0, ('tornado', tornado_compile, lambda template: template.generate(**CONTEXT)))
+
+    results = {}
+
+    for name, compile, render in paths:
+        template = compile()
+        compile_seconds = min(timeit.repeat(compile, number=1, repeat=repeat))
+        render_seconds = min(timeit.repeat(lambda: render(template), number=count, repeat=repeat))
+        results[name] = (compile_seconds * 1e3, render_seconds / count * 1e6)
+
+    return results
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    results = run(count)
+
+    if tornado is None:
+        print('tornado is not installed; timing the native path only')
+
+    for name in ('tornado', 'native'):
+        if name in results:
+            print('%-10s compile %8.2f ms  render %8.1f us' % ((name,) + results[name]))
+
+    if len(results) == 2:
+        print('speedup    compile %8.1fx    render %8.1fx' % (
+            results['tornado'][0] / results['native'][0], results['tornado'][1] / results['native'][1]))
@@ -0,0 +1,344 @@
+"""Times parsing, rendering and cache hits over the synthetic corpus.
+
+    python benchmarks/suite.py [--scale N] [--processes 4] [--output results.json]
+                               [--baseline results.json] [--threshold 0.25]
+
+Every template of ``benchmarks/corpus.py`` is timed for each target:
+
+* ``parse``: building the node tree, with the per-process line and fragment
+  memos cleared first so every run parses from scratch;
+* ``fold``: rendering the static subtrees of a freshly parsed tree once (see
+  ``parser.fold``), which is most of the rendering of a static template;
+* ``render``: ``to_html`` on the folded tree, the rest of a cache miss;
+* ``cache_hit``: ``HAML(...).to_html()`` answered from a warm cache.
+
+Every measurement is taken in each of ``--processes`` fresh processes, one
+after the other: how fast the same code runs varies by far more between
+processes, and over tens of seconds, than within one. Times are in seconds
+per call, the best of ``--repeat`` samples per process, taken in rounds over
+all cases. ``peak_bytes`` is the peak memory used to parse and render a
+template once: allocated memory as traced by ``tracemalloc`` where it exists,
+otherwise the growth of the maximum resident set size of a fresh process
+doing only that, which is coarser. ``memory`` names the method; it is
+``null`` with neither. ``results`` holds the best measurement of all
+processes and ``worst`` the worst.
+
+Results are written as JSON with ``--output``. With ``--baseline`` every
+measurement is compared with the same one in an earlier results file and the
+suite exits with status 1 if any is more than ``--threshold`` (a fraction)
+worse, and worse than the baseline's worst, so that a CI job can fail on
+regressions. Cases that look worse are measured again in as many processes
+first, and only regressions that remain count. Differences of less than a
+tenth of a millisecond or 512 KB are ignored as noise, and so is peak memory
+measured with a different method than the baseline's.
+"""
+
+from __future__ import print_function
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from corpus import corpus
+from haiku import HAML, Tornado, Underscore
+from haiku import element, parser
+from haiku.cache import Cache
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+TARGETS = (Tornado, Underscore)
+
+METRICS = ('parse', 'fold', 'render', 'cache_hit', 'peak_bytes')
+
+if tracemalloc is not None:
+    MEMORY = 'tracemalloc'
+elif resource is not None:
+    MEMORY = 'maxrss'
+else:
+    MEMORY = None
+
+# Every timing sample runs calls for at least this many seconds.
+SAMPLE = 0.02
+
+# Slowdowns smaller than this many seconds are timer noise, not regressions.
+NOISE = 1e-4
+
+# Nor is memory growth smaller than this many bytes: the resident set grows
+# an allocator arena at a time, 128 KB here, and the same run can end a few
+# arenas apart.
+NOISE_BYTES = 512 * 1024
+
+def _cold_parse(haml, target):
+    element._LINES.clear()
+    parser._FRAGMENTS.clear()
+    return parser.parse(HAML(haml, target=target, cache=Cache()), haml)
+
+def _cold_fold(haml, target):
+    return parser.fold(_cold_parse(haml, target))
+
+def _best(function, setup=None, repeat=5):
+    """Returns the best time per call of ``function`` over ``repeat`` samples,
+    each of calls adding up to at least ``SAMPLE`` seconds, with the garbage
+    collector off as with ``timeit``. With ``setup`` every call is passed a
+    fresh result of it, which is not timed."""
+
+    enabled = gc.isenabled()
+    gc.disable()
+
+    try:
+        best = None
+
+        for _ in range(repeat):
+            seconds = 0.0
+            calls = 0
+
+            while not calls or seconds < SAMPLE:
+                argument = setup() if setup is not None else None
+                start = timeit.default_timer()
+                function(argument)
+                seconds += timeit.default_timer() - start
+                calls += 1
+
+            if best is None or seconds / calls < best:
+                best = seconds / calls
+
+        return best
+    finally:
+        if enabled:
+            gc.enable()
+
+def _peak_bytes(haml, target):
+    if MEMORY == 'tracemalloc':
+        element._LINES.clear()
+        parser._FRAGMENTS.clear()
+
+        tracemalloc.start()
+
+        try:
+            HAML(haml, target=target, cache=Cache()).to_html()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    if MEMORY == 'maxrss':
+        process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--peak', target.__name__],
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        output, _ = process.communicate(haml)
+
+        if process.returncode:
+            raise RuntimeError('measuring peak memory failed')
+
+        return int(output)
+
+    return None
+
+def _maxrss():
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Linux counts kilobytes, macOS bytes.
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+def _peak(target):
+    """Prints how much the maximum resident set size of this process grows
+    while the template on stdin is parsed and rendered."""
+
+    haml = sys.stdin.read()
+    target = dict((target.__name__, target) for target in TARGETS)[target]
+    start = _maxrss()
+    HAML(haml, target=target, cache=Cache()).to_html()
+    print(_maxrss() - start)
+
+def measure(haml, target, repeat=5):
+    node = _cold_fold(haml, target)
+    cache = Cache()
+    HAML(haml, target=target, cache=cache).to_html()
+
+    return {
+        'parse': _best(lambda _: _cold_parse(haml, target), repeat=repeat),
+        'fold': _best(parser.fold, lambda: _cold_parse(haml, target), repeat),
+        'render': _best(lambda _: node.to_html(), repeat=repeat),
+        'cache_hit': _best(lambda _: HAML(haml, target=target, cache=cache).to_html(), repeat=repeat),
+    }
+
+def _cases(scale, names=None):
+    templates = corpus(scale)
+    cases = [('%s/%s' % (name, target.__name__), haml, target) for name, haml in templates for target in TARGETS]
+    return [case for case in cases if names is None or case[0] in names]
+
+def _times(scale, repeat, names=None):
+    """Prints the times of every case as JSON."""
+
+    cases = _cases(scale, names)
+    times = {}
+
+    # One sample of every case per round, so that the samples of each are
+    # spread over the whole run rather than all taken while it is slow.
+    for _ in range(repeat):
+        _merge(times, dict((case, measure(haml, target, 1)) for case, haml, target in cases))
+
+    print(json.dumps(times))
+
+def _measure_times(scale, repeat, names=None):
+    command = [sys.executable, os.path.abspath(__file__), '--times', '--scale', repr(scale), '--repeat', str(repeat)]
+
+    for name in names or ():
+        command += ['--case', name]
+
+    return json.loads(subprocess.check_output(command))
+
+def _merge(results, measured, pick=min):
+    for case, metrics in measured.items():
+        merged = results.setdefault(case, {})
+
+        for metric, value in metrics.items():
+            if merged.get(metric) is None:
+                merged[metric] = value
+            elif value is not None:
+                merged[metric] = pick(merged[metric], value)
+
+def run(scale=1, repeat=5, processes=4, names=None):
+    cases = _cases(scale, names)
+    results = {}
+    worst = {}
+
+    for _ in range(processes):
+        # Peak memory is measured before the times, though this process stays
+        # small anyway: on Linux a child process starts with the maximum
+        # resident set size of its parent.
+        measured = dict((case, {'peak_bytes': _peak_bytes(haml, target)}) for case, haml, target in cases)
+        _merge(measured, _measure_times(scale, repeat, names))
+        _merge(results, measured)
+        _merge(worst, measured, max)
+
+    return {
+        'python': platform.python_version(),
+        'scale': scale,
+        'memory': MEMORY,
+        'results': results,
+        'worst': worst,
+    }
+
+def compare(results, baseline, threshold=0.25):
+    """Returns ``(case, metric, baseline, result)`` for every measurement in
+    ``results`` more than ``threshold`` worse than in ``baseline`` and worse
+    than its worst process there. Times within ``NOISE`` of the baseline
+    always pass."""
+
+    regressions = []
+    metrics = METRICS
+
+    if baseline.get('memory') != results.get('memory'):
+        metrics = tuple(metric for metric in METRICS if metric != 'peak_bytes')
+
+    for case, measured in sorted(results['results'].items()):
+        base = baseline['results'].get(case, {})
+        worst = baseline.get('worst', {}).get(case, base)
+
+        for metric in metrics:
+            old = base.get(metric)
+            new = measured.get(metric)
+
+            if not old or new is None or new <= old * (1 + threshold):
+                continue
+
+            # Nor is anything one of the baseline's own processes measured.
+            if worst.get(metric) is not None and new <= worst[metric]:
+                continue
+
+            if new - old < (NOISE_BYTES if metric == 'peak_bytes' else NOISE):
+                continue
+
+            regressions.append((case, metric, old, new))
+
+    return regressions
+
+def _format(metric, value):
+    if value is None:
+        return '-'
+
+    if metric == 'peak_bytes':
+        return '%.1f KB' % (value / 1024.0)
+
+    return '%.3f ms' % (value * 1e3)
+
+def main(argv=None):
+    arguments = argparse.ArgumentParser(description='Benchmarks haiku over a synthetic corpus.')
+    arguments.add_argument('--scale', type=float, default=1, help='multiplies the size of every template')
+    arguments.add_argument('--repeat', type=int, default=5, help='samples per measurement, the best is kept')
+    arguments.add_argument('--processes', type=int, default=4,
+                           help='fresh processes to measure in, the best measurement is kept')
+    arguments.add_argument('--output', help='writes the results to this JSON file')
+    arguments.add_argument('--baseline', help='compares the results with this JSON file')
+    arguments.add_argument('--threshold', type=float, default=0.25,
+                           help='fails when a measurement is this fraction worse than the baseline')
+    arguments.add_argument('--peak', help=argparse.SUPPRESS)
+    arguments.add_argument('--times', action='store_true', help=argparse.SUPPRESS)
+    arguments.add_argument('--case', action='append', help=argparse.SUPPRESS)
+    args = arguments.parse_args(argv)
+
+    if args.peak:
+        _peak(args.peak)
+        return 0
+
+    if args.times:
+        _times(args.scale, args.repeat, args.case)
+        return 0
+
+    baseline = None
+    regressions = []
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        if baseline.get('scale') != args.scale:
+            print('baseline was measured at scale %s' % baseline.get('scale'))
+            return 2
+
+    results = run(args.scale, args.repeat, args.processes)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+
+        if regressions:
+            names = set(case for case, _, _, _ in regressions)
+            again = run(args.scale, args.repeat, args.processes, names)
+            _merge(results['results'], again['results'])
+            _merge(results['worst'], again['worst'], max)
+            regressions = compare(results, baseline, args.threshold)
+
+    row = '%-26s' + ' %12s' * len(METRICS)
+
+    print(row % (('case',) + METRICS))
+
+    for case, metrics in sorted(results['results'].items()):
+        print(row % ((case,) + tuple(_format(metric, metrics[metric]) for metric in METRICS)))
+
+    if MEMORY is None:
+        print('neither tracemalloc nor resource is available; peak memory was not measured')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    for case, metric, old, new in regressions:
+        print('regression: %s %s %s -> %s' % (case, metric, _format(metric, old), _format(metric, new)))
+
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
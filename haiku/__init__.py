@@ -1,2 +1,4 @@
+from .constants import VERSION as __version__
 from .haml import HAML
+from .service import compile_async, compile_many_async
 from .target import *
\ No newline at end of file
@@ -0,0 +1,270 @@
+from collections import OrderedDict
+from .constants import VERSION
+import hashlib
+import os
+import tempfile
+import threading
+
+# Prefix of the files ``DiskCache.set`` writes before renaming them into place.
+_TEMPORARY = '.tmp'
+
+class Cache(object):
+    """A bounded, least recently used cache of compiled templates.
+
+    Keys are ``(sha1, target class, options)`` tuples as built by
+    ``HAML.cache_key``. The cache holds at most ``max_entries`` items and at
+    most ``max_bytes`` of compiled output (measured with ``len``); either limit
+    can be ``None``. Hits, misses and evictions are counted for reporting.
+    Every operation holds a lock, so a cache can be shared between threads.
+    """
+
+    def __init__(self, max_entries=1000, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+
+            self._entries[key] = value
+            self.hits += 1
+
+        return value
+
+    def set(self, key, value):
+        size = len(value)
+
+        with self._lock:
+            self._delete(key)
+
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+
+            self._entries[key] = value
+            self._bytes += size
+
+            while self._full():
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def _full(self):
+        if self.max_entries is not None and len(self._entries) > self.max_entries:
+            return True
+
+        return self.max_bytes is not None and self._bytes > self.max_bytes
+
+    def delete(self, key):
+        with self._lock:
+            self._delete(key)
+
+    def _delete(self, key):
+        value = self._entries.pop(key, None)
+
+        if value is not None:
+            self._bytes -= len(value)
+
+    def invalidate(self, sha1):
+        """Drops every entry compiled from the source with this hash."""
+
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == sha1]:
+                self._delete(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+class DiskCache(object):
+    """A content-addressed cache of compiled templates in a directory.
+
+    Entries are keyed by the source hash, the target and the haiku version, so
+    every process pointed at the same directory compiles a template once per
+    release; the entries of one source are kept together so that
+    ``invalidate`` can find them. Files are written to a temporary name and renamed into place, so
+    readers never see a partial entry. Output is stored as UTF-8 and read back
+    as a ``str``, as rendering returns it. An optional in-memory ``Cache`` can
+    be put in front of it with ``memory``.
+    """
+
+    def __init__(self, directory, memory=None):
+        self.directory = directory
+        self.memory = memory
+
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key):
+        sha1, target, options = key
+        name = hashlib.sha1(repr(('%s.%s' % (target.__module__, target.__name__), options, VERSION))).hexdigest()
+        return os.path.join(self._source_directory(sha1), name)
+
+    def _source_directory(self, sha1):
+        # Every entry compiled from a source is kept in one directory.
+        return os.path.join(self.directory, sha1[:2], sha1)
+
+    def get(self, key, default=None):
+        if self.memory is not None:
+            value = self.memory.get(key)
+
+            if value is not None:
+                return value
+
+        try:
+            with open(self.path(key), 'rb') as f:
+                value = f.read()
+        except (IOError, OSError):
+            self.misses += 1
+            return default
+
+        self.hits += 1
+
+        if self.memory is not None:
+            self.memory.set(key, value)
+
+        return value
+
+    def set(self, key, value):
+        if self.memory is not None:
+            self.memory.set(key, value)
+
+        path = self.path(key)
+        directory = os.path.dirname(path)
+
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=_TEMPORARY)
+
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(value)
+
+            os.rename(tmp, path)
+        except Exception:
+            os.unlink(tmp)
+            raise
+
+    def delete(self, key):
+        if self.memory is not None:
+            self.memory.delete(key)
+
+        try:
+            os.unlink(self.path(key))
+        except OSError:
+            pass
+
+    def invalidate(self, sha1):
+        """Drops every entry compiled from the source with this hash."""
+
+        if self.memory is not None:
+            self.memory.invalidate(sha1)
+
+        directory = self._source_directory(sha1)
+
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return
+
+        for name in names:
+            # Files still being written by another process are left alone.
+            if name.startswith(_TEMPORARY):
+                continue
+
+            try:
+                os.unlink(os.path.join(directory, name))
+            except OSError:
+                pass
+
+    def clear(self):
+        if self.memory is not None:
+            self.memory.clear()
+
+        for path, _, _ in self._entries():
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def prune(self, max_bytes):
+        """Removes the least recently written entries until at most
+        ``max_bytes`` remain on disk. Returns the number of removed entries."""
+
+        entries = sorted(self._entries(), key=lambda entry: entry[2], reverse=True)
+        total = 0
+        removed = 0
+
+        for path, size, _ in entries:
+            total += size
+
+            if total > max_bytes:
+                try:
+                    os.unlink(path)
+                    removed += 1
+                except OSError:
+                    pass
+
+        return removed
+
+    def _entries(self):
+        # Files still being written by another process are not entries yet.
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.startswith(_TEMPORARY):
+                    continue
+
+                path = os.path.join(root, name)
+
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+
+                yield path, stat.st_size, stat.st_mtime
+
+    def stats(self):
+        sizes = [size for _, size, _ in self._entries()]
+
+        return {
+            'entries': len(sizes),
+            'bytes': sum(sizes),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
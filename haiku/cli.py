@@ -0,0 +1,279 @@
+from .cache import Cache, DiskCache
+from .constants import VERSION
+from .incremental import Incremental
+from .loader import Loader
+from . import javascript
+from . import target as targets
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+MANIFEST = '.haiku-manifest.json'
+
+def _targets():
+    return dict((name, cls) for name, cls in vars(targets).items()
+                if isinstance(cls, type) and issubclass(cls, targets.Default))
+
+def find_templates(directory, extension='.haml'):
+    """Yields the path of every template under ``directory``, relative to it."""
+
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+
+        for name in sorted(files):
+            if name.endswith(extension):
+                yield os.path.relpath(os.path.join(root, name), directory)
+
+def compile_file(job):
+    """Compiles one template; runs inside the worker processes. Returns the
+    time it took, the error if it failed and the templates it includes."""
+
+    root, name, output, target = job
+    start = time.time()
+    loader = Loader(root)
+
+    try:
+        # A cache of its own, as the process wide one would return the output
+        # of this template from before its includes changed.
+        _write(output, loader.load(name, target=_targets()[target], cache=Cache()).to_html())
+    except Exception as e:
+        return time.time() - start, '%s: %s' % (type(e).__name__, e), []
+
+    includes = [os.path.relpath(loader.resolve(include), root) for include in loader.dependencies(name)]
+
+    return time.time() - start, None, sorted(includes)
+
+def _write(path, html):
+    if isinstance(html, unicode):
+        html = html.encode('utf-8')
+
+    directory = os.path.dirname(path)
+
+    if directory and not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+
+    with open(path, 'wb') as f:
+        f.write(html)
+
+def _load_manifest(path, target):
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (IOError, ValueError):
+        return {}, {}
+
+    if manifest.get('version') != VERSION or manifest.get('target') != target:
+        return {}, {}
+
+    return manifest.get('files', {}), manifest.get('includes', {})
+
+def compile_tree(source, output, target='Tornado', extension='.html', jobs=None, force=False, out=sys.stdout):
+    """Compiles every template under ``source`` into ``output``, skipping the
+    ones whose source hash, and the hashes of the templates they include,
+    match the manifest of the previous run. Returns the number of templates
+    that failed to compile."""
+
+    manifest_path = os.path.join(output, MANIFEST)
+    manifest, manifest_includes = ({}, {}) if force else _load_manifest(manifest_path, target)
+
+    hashes = {}
+
+    for name in find_templates(source):
+        with open(os.path.join(source, name), 'rb') as f:
+            hashes[name] = hashlib.sha1(f.read()).hexdigest()
+
+    files = {}
+    includes = {}
+    pending = []
+
+    for name, sha1 in sorted(hashes.items()):
+        destination = os.path.join(output, os.path.splitext(name)[0] + extension)
+        unchanged = [manifest.get(name)] + [manifest.get(include) for include in manifest_includes.get(name, ())]
+        current = [sha1] + [hashes.get(include) for include in manifest_includes.get(name, ())]
+
+        if unchanged == current and os.path.exists(destination):
+            files[name] = sha1
+            includes[name] = manifest_includes.get(name, [])
+            continue
+
+        pending.append((name, sha1, (source, name, destination, target)))
+
+    skipped = len(files)
+    jobs = jobs or multiprocessing.cpu_count()
+    start = time.time()
+
+    if jobs > 1 and len(pending) > 1:
+        pool = multiprocessing.Pool(jobs)
+
+        try:
+            results = pool.map(compile_file, [job for _, _, job in pending])
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [compile_file(job) for _, _, job in pending]
+
+    failed = 0
+
+    for (name, sha1, _), (seconds, error, dependencies) in zip(pending, results):
+        if error:
+            failed += 1
+            out.write('%8.1fms  %s  FAILED %s\n' % (seconds * 1000, name, error))
+        else:
+            files[name] = sha1
+            includes[name] = dependencies
+            out.write('%8.1fms  %s\n' % (seconds * 1000, name))
+
+    out.write('compiled %d, skipped %d, failed %d in %.2fs\n' % (
+        len(pending) - failed, skipped, failed, time.time() - start))
+
+    if not os.path.isdir(output):
+        os.makedirs(output)
+
+    with open(manifest_path, 'w') as f:
+        json.dump({'version': VERSION, 'target': target, 'files': files, 'includes': includes},
+                  f, indent=2, sort_keys=True)
+
+    return failed
+
+def bundle_tree(source, output, name='JST', out=sys.stdout):
+    """Compiles every template under ``source`` into a JavaScript function and
+    writes them all into the module ``output``, keyed by their path without
+    the extension."""
+
+    loader = Loader(source)
+    templates = [(os.path.splitext(path)[0].replace(os.sep, '/'), loader.read(path)) for path in find_templates(source)]
+
+    with open(output, 'wb') as f:
+        f.write(javascript.bundle(templates, name, loader))
+
+    out.write('bundled %d templates into %s\n' % (len(templates), output))
+
+class Watcher(object):
+    """Recompiles the templates under ``source`` into ``output`` as they
+    change. Every template keeps its parsed tree between changes, so only the
+    blocks around an edit are parsed and rendered again (see
+    ``haiku.incremental``)."""
+
+    def __init__(self, source, output, target='Tornado', extension='.html', out=sys.stdout):
+        self.source = source
+        self.output = output
+        self.target = _targets()[target]
+        self.extension = extension
+        self.out = out
+
+        self.loader = Loader(source)
+
+        self._stats = {}
+        self._templates = {}
+
+    def poll(self):
+        """Compiles the templates that changed since the last poll and the
+        ones that include them. Returns their names."""
+
+        stats = {}
+
+        for name in find_templates(self.source):
+            try:
+                stat = os.stat(os.path.join(self.source, name))
+            except OSError:
+                continue
+
+            stats[name] = (stat.st_mtime, stat.st_size)
+
+        changed = set(name for name in stats if self._stats.get(name) != stats[name])
+        changed.update(name for name in self._stats if name not in stats)
+
+        for name in changed:
+            # Includes name templates without the extension.
+            self.loader.invalidate(name)
+            self.loader.invalidate(os.path.splitext(name)[0].replace(os.sep, '/'))
+
+            if name not in stats:
+                self._templates.pop(name, None)
+
+        partials = set(os.path.splitext(name)[0].replace(os.sep, '/') for name in changed)
+        names = [name for name in sorted(stats) if name in changed or self.loader.dependencies(name) & partials]
+
+        self._stats = stats
+
+        for name in names:
+            self._compile(name)
+
+        return names
+
+    def _compile(self, name):
+        start = time.time()
+        template = self._templates.get(name)
+
+        if template is None:
+            template = self._templates[name] = Incremental(self.target, loader=self.loader)
+
+        try:
+            html = template.render(self.loader.read(name))
+            _write(os.path.join(self.output, os.path.splitext(name)[0] + self.extension), html)
+        except Exception as e:
+            self.out.write('%8.1fms  %s  FAILED %s: %s\n' % ((time.time() - start) * 1000, name, type(e).__name__, e))
+            return
+
+        self.out.write('%8.1fms  %s  (%d blocks parsed, %d reused)\n' % (
+            (time.time() - start) * 1000, name, template.parsed, template.reused))
+
+    def run(self, interval=0.5):
+        while True:
+            self.poll()
+            time.sleep(interval)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='haiku', description='Compile HAML templates.')
+    subparsers = parser.add_subparsers(dest='command')
+
+    compile_parser = subparsers.add_parser('compile', help='compile a tree of templates')
+    compile_parser.add_argument('source', help='directory with .haml templates')
+    compile_parser.add_argument('output', help='directory to write compiled templates to')
+    compile_parser.add_argument('-t', '--target', default='Tornado', choices=sorted(_targets()))
+    compile_parser.add_argument('-e', '--extension', default='.html', help='extension of compiled templates')
+    compile_parser.add_argument('-j', '--jobs', type=int, default=None, help='worker processes (default: one per CPU)')
+    compile_parser.add_argument('-f', '--force', action='store_true', help='ignore the manifest and compile everything')
+
+    bundle_parser = subparsers.add_parser('bundle', help='compile a tree of templates into one JavaScript module')
+    bundle_parser.add_argument('source', help='directory with .haml templates')
+    bundle_parser.add_argument('output', help='JavaScript file to write')
+    bundle_parser.add_argument('-n', '--name', default='JST', help='global to export the templates as without a module system')
+
+    watch_parser = subparsers.add_parser('watch', help='recompile a tree of templates as they change')
+    watch_parser.add_argument('source', help='directory with .haml templates')
+    watch_parser.add_argument('output', help='directory to write compiled templates to')
+    watch_parser.add_argument('-t', '--target', default='Tornado', choices=sorted(_targets()))
+    watch_parser.add_argument('-e', '--extension', default='.html', help='extension of compiled templates')
+    watch_parser.add_argument('-i', '--interval', type=float, default=0.5, help='seconds between polls')
+
+    prune_parser = subparsers.add_parser('prune-cache', help='shrink a disk cache to a size')
+    prune_parser.add_argument('directory')
+    prune_parser.add_argument('--max-bytes', type=int, required=True)
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'compile':
+        if compile_tree(args.source, args.output, args.target, args.extension, args.jobs, args.force):
+            return 1
+    elif args.command == 'bundle':
+        bundle_tree(args.source, args.output, args.name)
+    elif args.command == 'watch':
+        try:
+            Watcher(args.source, args.output, args.target, args.extension).run(args.interval)
+        except KeyboardInterrupt:
+            pass
+    elif args.command == 'prune-cache':
+        removed = DiskCache(args.directory).prune(args.max_bytes)
+        sys.stdout.write('removed %d entries\n' % removed)
+
+    return 0
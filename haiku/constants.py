@@ -11,6 +11,9 @@ OPERATORS = {
     'multiline': '|',
     'innerstrip': '<',
     'outerstrip': '>',
+    'include': '+',
     }
 
-INDENT = 2
\ No newline at end of file
+INDENT = 2
+
+VERSION = '0.1.0'
\ No newline at end of file
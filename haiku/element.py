@@ -1,191 +1,356 @@
 from .constants import OPERATORS
 from . import utils
-import re
+import ast
+import string
 
 _AUTOCLOSE = ('meta', 'img', 'link', 'br', 'hr', 'input', 'area', 'param', 'col', 'base',)
-_HAML_REGEX = re.compile(
-    r'(?P<tag>%\w+)?'
-    r'(?P<id>#[:_\w-]*)?'
-    r'(?P<class>\.[:\w\.-]*)*'
-    r'(?P<attributes>\(.*\))?'
-    r'(?P<dict>\{.*\})?'
-    r'(?P<innerstrip><)?'
-    r'(?P<outerstrip>>)?'
-    r'(?P<autoclose>/)?'
-    r'(?P<evaluate>=)?'
-    r'(?P<content>[^\w\.#\{].*)?'
-)
+
+# Tags whose surrounding whitespace is insignificant, which compact output drops.
+BLOCK = frozenset(('html', 'head', 'body', 'title', 'meta', 'link', 'script', 'style', 'base',
+                   'div', 'p', 'ul', 'ol', 'li', 'dl', 'dt', 'dd', 'table', 'thead', 'tbody',
+                   'tfoot', 'tr', 'th', 'td', 'caption', 'colgroup', 'col', 'form', 'fieldset',
+                   'legend', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'br', 'blockquote',
+                   'address', 'section', 'article', 'aside', 'header', 'footer', 'nav', 'main',
+                   'figure', 'figcaption', 'noscript', 'option', 'optgroup'))
+
+# Tags whose content is whitespace sensitive, which compact output keeps as is.
+PRESERVE = frozenset(('pre', 'textarea'))
 _NEWLINE = '\n'
 
-class HTMLElement(object):
-    def __init__(self, node):
-        self.node = node
+_WORD = frozenset(string.ascii_letters + string.digits + '_')
+_ID = _WORD | frozenset(':-')
+_CLASS = _WORD | frozenset(':.-')
+_NOT_CONTENT = _WORD | frozenset('.#{')
+_FLAGS = (
+    ('innerstrip', OPERATORS['innerstrip']),
+    ('outerstrip', OPERATORS['outerstrip']),
+    ('autoclose', '/'),
+    ('evaluate', OPERATORS['evaluate']),
+)
 
-        self.tag = None
-        self.id = None
-        self.classes = None
-        self.autoclose = False
-        self.evaluate = False
-        self.content = ''
+# Parsed element lines, keyed by line text. Cleared when it grows too large.
+_LINES = {}
+_LINES_SIZE = 10000
 
-        self._parse_haml_line(node.haml)
+def scan(haml):
+    """Splits an element line into its parts in a single left-to-right pass.
 
-    def get_attributes(self):
-        attributes = []
+    Returns a dict with the ``tag``, ``id``, ``class``, ``attributes``, ``dict``,
+    ``innerstrip``, ``outerstrip``, ``autoclose``, ``evaluate`` and ``content``
+    parts of the line, each an empty string when missing.
+    """
 
-        if self.id:
-            attributes.append('id="%s"' % self.id)
+    length = len(haml)
+    groups = dict.fromkeys(('tag', 'id', 'class', 'attributes', 'dict', 'innerstrip',
+                            'outerstrip', 'autoclose', 'evaluate', 'content'), '')
 
-        if self.classes:
-            attributes.append('class="%s"' % ' '.join(self.classes))
+    def take(i, start, chars):
+        j = i + len(start)
 
-        for k, v in self.attributes.items():
-            v = self._get_html_value(v)
+        while j < length and haml[j] in chars:
+            j += 1
 
-            if v:
-                attributes.append('%s="%s"' % (k, v))
+        return j
 
-        return ' '.join(attributes)
+    i = 0
 
-    def _parse_haml_line(self, haml):
-        groups = _HAML_REGEX.search(haml).groupdict('')
+    if haml.startswith(OPERATORS['element']):
+        j = take(i, OPERATORS['element'], _WORD)
+
+        if j > 1:
+            groups['tag'], i = haml[:j], j
+
+    if haml.startswith(OPERATORS['id'], i):
+        j = take(i, OPERATORS['id'], _ID)
+        groups['id'], i = haml[i:j], j
+
+    if haml.startswith(OPERATORS['class'], i):
+        j = take(i, OPERATORS['class'], _CLASS)
+        groups['class'], i = haml[i:j], j
+
+    # Attribute groups run to the last closing bracket on the line.
+    for name, open, close in (('attributes', '(', ')'), ('dict', '{', '}')):
+        if haml.startswith(open, i):
+            j = haml.rfind(close, i + 1)
+
+            if j != -1:
+                groups[name], i = haml[i:j + 1], j + 1
 
-        # Decide HTML Tag
-        self.tag = groups.get('tag').strip(OPERATORS['element']) or 'div'
+    for name, operator in _FLAGS:
+        if haml.startswith(operator, i):
+            groups[name], i = operator, i + 1
 
-        # Parse Atttributes
-        attributes = groups.get('dict')
-        self.attributes = eval(attributes) if attributes else {}
+    if i < length and haml[i] not in _NOT_CONTENT:
+        groups['content'] = haml[i:]
 
-        attributes = groups.get('attributes')
+    return groups
 
-        if attributes:
+def _parse_attributes(attributes):
+    # Pairs of an "(a='1' b=c)" group; bare words are joined to the next value.
+    pairs = []
+    carry = []
+
+    for pair in attributes[1:-1].split(' ')[::-1]:
+        k, eq, v = [part.strip() for part in pair.partition('=')]
+
+        if not eq and not v:
+            carry.append(k)
+            continue
+
+        if carry:
+            carry.append(v)
+            v = ' '.join(carry[::-1])
             carry = []
 
-            for pair in attributes[1:-1].split(' ')[::-1]:
-                parts = map(str.strip, pair.partition('='))
-                k, eq, v = parts
+        if not v:
+            continue
+
+        if not (v.startswith('"') or v.startswith("'")):
+            if not v.isdigit():
+                v = '= ' + v
+        else:
+            v = v[1:-1]
 
-                if not eq and not v:
-                    carry.append(k)
-                    continue
+        pairs.append((k, v))
 
-                if carry:
-                    carry.append(v)
-                    v = ' '.join(carry[::-1])
-                    carry = []
+    return pairs
 
-                if not v:
-                    continue
+def _eval_dict(attributes):
+    try:
+        return ast.literal_eval(attributes)
+    except (ValueError, SyntaxError):
+        return eval(attributes)
 
-                if not (v.startswith('"') or v.startswith("'")):
-                    if not v.isdigit():
-                        v = '= ' + v
-                else:
-                    v = v[1:-1]
+def _is_dynamic(value, nested=True):
+    if isinstance(value, (list, tuple)):
+        return nested and any(_is_dynamic(v) for v in value)
 
-                self.attributes[k] = v
+    return isinstance(value, (str, unicode)) and value[:1] == OPERATORS['evaluate']
+
+def _get_html_value(v, target):
+    if not v:
+        return ''
+
+    if isinstance(v, (str, unicode)) and v and v[0] == OPERATORS['evaluate']:
+        return target.eval(v.lstrip(OPERATORS['evaluate']).strip())
+
+    v = str(v)
 
-        # Parse Elemnt Id
-        self.id = [groups.get('id', '').lstrip(OPERATORS['id'])]
+    if '#{' in v or '{%' in v or '{{' in v or '<%' in v:
+        v = v.replace('"', "'")
+    else:
+        v = utils.xhtml_escape(v)
 
-        if 'id' in self.attributes:
-            if isinstance(self.attributes['id'], (list, tuple)):
-                self.id.append(self.attributes['id'])
-            else:
-                self.id.append(self.attributes['id'])
+    return v
 
-            del self.attributes['id']
+def _flatten(iterable, target):
+    if not isinstance(iterable, (list, tuple)):
+        yield _get_html_value(iterable, target)
+    else:
+        for value in iterable:
+            if isinstance(value, (list, tuple)):
+                for sub_value in _flatten(value, target):
+                    if sub_value:
+                        yield _get_html_value(sub_value, target)
+            elif value:
+                yield _get_html_value(value, target)
 
-        self.id = '_'.join(self._flatten(self.id))
+def _resolve(line, target):
+    """Returns the ``(id, classes, attributes)`` of a parsed line, where
+    ``attributes`` is a list of the remaining ``(name, value)`` pairs."""
 
-        # Parse Classes
-        self.classes = set()
+    ids = [line.id]
 
-        if 'class' in self.attributes:
-            for class_ in self._flatten(self.attributes['class']):
-                if class_:
-                    self.classes.add(class_)
+    if 'id' in line.attributes:
+        ids.append(line.attributes['id'])
 
-            del self.attributes['class']
+    classes = set()
 
-        for class_ in groups.get('class').lstrip(OPERATORS['class']).split('.'):
+    if 'class' in line.attributes:
+        for class_ in _flatten(line.attributes['class'], target):
             if class_:
-                self.classes.add(class_)
+                classes.add(class_)
 
-        self.classes = sorted(self.classes)
+    for class_ in line.classes.lstrip(OPERATORS['class']).split('.'):
+        if class_:
+            classes.add(class_)
 
-        self.autoclose = not not groups.get('autoclose') or self.tag in _AUTOCLOSE
-        self.innerstrip = not not groups.get('innerstrip')
-        self.outerstrip = not not groups.get('outerstrip')
-        self.evaluate = not not groups.get('evaluate')
-        self.content = groups.get('content').strip()
+    attributes = [(k, v) for k, v in line.attributes.items() if k not in ('id', 'class')]
 
-    def _get_html_value(self, v):
-        if not v:
-            return ''
+    return '_'.join(_flatten(ids, target)), sorted(classes), attributes
 
-        if isinstance(v, (str, unicode)) and v and v[0] == OPERATORS['evaluate']:
-            return self.node.parser.target.eval(v.lstrip(OPERATORS['evaluate']).strip())
+def _render_attributes(id, classes, attributes, target):
+    html = []
 
-        v = str(v)
+    if id:
+        html.append('id="%s"' % id)
 
-        if '#{' in v or '{%' in v or '{{' in v or '<%' in v:
-            v = v.replace('"', "'")
-        else:
-            v = utils.xhtml_escape(v)
+    if classes:
+        html.append('class="%s"' % ' '.join(classes))
+
+    for k, v in attributes:
+        v = _get_html_value(v, target)
+
+        if v:
+            html.append('%s="%s"' % (k, v))
+
+    return ' '.join(html)
+
+class _Line(object):
+    """The target independent parse of an element line.
+
+    When no id, class or attribute value is evaluated, the resolved parts and
+    the attribute string are computed once here (``html`` is not ``None``).
+    A line is ``static`` when its output does not depend on the target at all.
+    """
+
+    __slots__ = ('tag', 'id', 'classes', 'attributes', 'autoclose', 'innerstrip',
+                 'outerstrip', 'evaluate', 'content', 'resolved', 'html', 'interpolation',
+                 'static')
+
+    def __init__(self, haml):
+        groups = scan(haml)
+
+        self.tag = groups['tag'].strip(OPERATORS['element']) or 'div'
+        self.id = groups['id'].lstrip(OPERATORS['id'])
+        self.classes = groups['class']
 
-        return v
+        self.attributes = _eval_dict(groups['dict']) if groups['dict'] else {}
 
-    def _flatten(self, iterable):
-        if not isinstance(iterable, (list, tuple)):
-            yield self._get_html_value(iterable)
+        if groups['attributes']:
+            for k, v in _parse_attributes(groups['attributes']):
+                self.attributes[k] = v
+
+        self.autoclose = not not groups['autoclose'] or self.tag in _AUTOCLOSE
+        self.innerstrip = not not groups['innerstrip']
+        self.outerstrip = not not groups['outerstrip']
+        self.evaluate = not not groups['evaluate']
+        self.content = groups['content'].strip()
+
+        self.resolved = None
+        self.html = None
+        self.interpolation = None
+
+        if not self.evaluate:
+            self.interpolation = utils.split_interpolation(self.content)
+
+        dynamic = any(_is_dynamic(v, k in ('id', 'class')) for k, v in self.attributes.items())
+
+        if not dynamic:
+            self.resolved = id, classes, attributes = _resolve(self, None)
+            self.html = _render_attributes(id, classes, attributes, None)
+
+        self.static = (self.html is not None and not self.evaluate and self.interpolation is None
+                       and utils.split_interpolation(self.html) is None)
+
+def parse_line(haml):
+    line = _LINES.get(haml)
+
+    if line is None:
+        if len(_LINES) >= _LINES_SIZE:
+            _LINES.clear()
+
+        line = _LINES[haml] = _Line(haml)
+
+    return line
+
+class HTMLElement(object):
+    def __init__(self, node):
+        self.node = node
+
+        self.tag = None
+        self.id = None
+        self.classes = None
+        self.autoclose = False
+        self.evaluate = False
+        self.content = ''
+
+        self._parse_haml_line(node.haml)
+
+    def get_attributes(self):
+        html = self._html
+
+        if html is None:
+            html = _render_attributes(self.id, self.classes, self.attributes, self.node.parser.target)
+
+        return utils.interpolate(html, self.node.parser.target)
+
+    def _parse_haml_line(self, haml):
+        line = parse_line(haml)
+
+        self.tag = line.tag
+        self.autoclose = line.autoclose
+        self.innerstrip = line.innerstrip
+        self.outerstrip = line.outerstrip
+        self.evaluate = line.evaluate
+        self.content = line.content
+
+        self._interpolation = line.interpolation
+
+        if line.resolved is not None:
+            self.id, self.classes, self.attributes = line.resolved
         else:
-            for value in iterable:
-                if isinstance(value, (list, tuple)):
-                    for sub_value in self._flatten(value):
-                        if sub_value:
-                            yield self._get_html_value(sub_value)
-                elif value:
-                    yield self._get_html_value(value)
+            self.id, self.classes, self.attributes = _resolve(line, self.node.parser.target)
+
+        self._html = line.html
 
     def get_inline_content(self):
         inline_content = self.content
 
         if self.evaluate:
             inline_content = self.node.parser.target.eval(inline_content)
+        elif self._interpolation is not None:
+            inline_content = utils.join_interpolation(self._interpolation, self.node.parser.target)
 
         return inline_content
 
     def render(self, content='', indentation=0):
-        buf = []
+        return ''.join(self.iter_render((content,), indentation))
+
+    def iter_render(self, children=(), indentation=0, compact=False, lstrip=False):
+        """Yields the element as chunks, wrapped around the rendered ``children``.
+
+        With ``compact`` the newlines around the children of a block element
+        are left out. With ``lstrip`` the opening tag is not indented.
+        """
 
         attributes = [self.tag, self.get_attributes()]
 
         if self.autoclose:
             attributes.append('/')
 
-        buf.append(utils.indent('<%s>' % ' '.join(filter(bool, attributes)), indentation))
+        yield str(utils.indent('<%s>' % ' '.join(filter(bool, attributes)), 0 if lstrip else indentation))
+
+        if self.autoclose:
+            return
+
+        first, children = utils.peek_chunks(children)
+        content = self._iter_content(first is not None, children, compact and self.tag in BLOCK)
+
+        if first is None:
+            indentation = 0
+
+        if self.innerstrip:
+            content = utils.strip_chunks(content)
+            indentation = 0
 
-        if not self.autoclose:
-            content_buf = []
+        for chunk in content:
+            yield chunk
 
-            if self.content:
-                content_buf.append(self.get_inline_content())
+        yield str(utils.indent('</%s>' % self.tag, indentation))
 
-            if content:
-                content_buf.append(_NEWLINE)
-                content_buf.append(content)
-                content_buf.append(_NEWLINE)
-            else:
-                indentation = 0
+    def _iter_content(self, has_children, children, compact=False):
+        if self.content:
+            yield str(self.get_inline_content())
 
-            if self.innerstrip:
-                buf.append(''.join(content_buf).strip())
-                indentation = 0
-            else:
-                buf.extend(content_buf)
+        if has_children:
+            # Leading whitespace of a block is insignificant, but not the
+            # whitespace separating its inline content from the children.
+            if not compact or self.content:
+                yield _NEWLINE
 
-            buf.append(utils.indent('</%s>' % self.tag, indentation))
+            for chunk in children:
+                yield chunk
 
-        return ''.join(map(str, buf))
\ No newline at end of file
+            if not compact:
+                yield _NEWLINE
@@ -1,14 +1,52 @@
-from .node import Node
+from .cache import Cache
+from .parser import MappedSource, fold, parse
 from .target import Default
+from . import instrument
 import hashlib
 
-_CACHE = {}
+_CACHE = Cache()
 
 class HAML(object):
-    def __init__(self, haml, target=Default):
+    def __init__(self, haml, target=Default, cache=None, compact=False, loader=None):
+        self.haml = haml
         self.sha1 = hashlib.sha1(haml).hexdigest()
-        self.node = Node(self, '', haml)
         self.target = target()
+        self.cache = _CACHE if cache is None else cache
+
+        # Resolves "+ name" includes; see ``haiku.loader.Loader``.
+        self.loader = loader
+
+        # Render options that change the output; they are part of the cache key.
+        self.options = {}
+
+        if compact:
+            self.options['compact'] = True
+
+        self._node = None
+
+        # Number of nodes built and of lines skipped, once parsed.
+        self.parse_stats = None
+
+        # Instrumentation hooks installed when the template was created.
+        self.hooks = instrument.active()
+
+        if self.hooks is not None:
+            instrument.instrument_target(self.target, self.hooks)
+
+    @classmethod
+    def from_path(cls, path, target=Default, cache=None, compact=False, loader=None):
+        """Returns the template in the file at ``path``, memory-mapped rather
+        than read into a string; ``haml`` is then its ``MappedSource``. The
+        cache key is the same as for the file's contents as a string, and a
+        cache hit never parses or copies the template."""
+
+        source = MappedSource(path)
+
+        template = cls('', target=target, cache=cache, compact=compact, loader=loader)
+        template.haml = source
+        template.sha1 = source.sha1
+
+        return template
 
     def __str__(self):
         return self.to_html()
@@ -16,8 +54,87 @@ class HAML(object):
     def __unicode__(self):
         return self.to_html()
 
+    @property
+    def node(self):
+        # Parsed on first use so that cache hits never pay for it.
+        if self._node is None:
+            self.parse_stats = {}
+
+            if self.hooks is None:
+                self._node = fold(parse(self, self.haml, stats=self.parse_stats))
+            else:
+                self._node = self._timed_parse()
+
+        return self._node
+
+    @property
+    def cache_key(self):
+        options = tuple(sorted(self.options.items()))
+
+        # The output also depends on every template this one includes.
+        if self.loader is not None:
+            includes = self.loader.digest(self)
+
+            if includes:
+                options += (('includes', includes),)
+
+        return self.sha1, type(self.target), options
+
     def to_html(self):
-        if self.sha1 not in _CACHE:
-            _CACHE[self.sha1] = self.node.to_html()
+        key = self.cache_key
+        html = self.cache.get(key)
+
+        if html is None:
+            html = self.render()
+            self.cache.set(key, html)
+
+        return html
+
+    def render(self):
+        """Renders the template without looking at or filling the cache."""
+
+        if self.hooks is None:
+            return self.node.to_html()
+
+        return self._timed_render()
+
+    def _timed_parse(self):
+        start = instrument._clock()
+        node = fold(parse(self, self.haml, stats=self.parse_stats))
+        seconds = instrument._clock() - start
+
+        for hook in self.hooks:
+            hook.parsed(self, seconds, self.parse_stats['nodes'], self.parse_stats['skipped'])
+
+        return node
+
+    def _timed_render(self):
+        node = self.node
+        start = instrument._clock()
+        html = node.to_html()
+        seconds = instrument._clock() - start
+
+        for hook in self.hooks:
+            hook.rendered(self, seconds, len(html))
+
+        return html
+
+    def iter_html(self):
+        """Yields the output in document order without building it in memory.
+
+        Output that is already cached is yielded as is; otherwise the template
+        is rendered as it is consumed and the result is not cached.
+        """
+
+        html = self.cache.get(self.cache_key)
+
+        if html is not None:
+            yield html
+            return
+
+        for chunk in self.node.iter_html():
+            yield chunk
 
-        return _CACHE[self.sha1]
+    def write_to(self, f):
+        for chunk in self.iter_html():
+            f.write(chunk)
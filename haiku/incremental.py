@@ -0,0 +1,178 @@
+"""Re-renders successive versions of a template, redoing only what changed.
+
+Every block of a template, a line together with the lines nested under it, is
+keyed by a hash of its text and of what else its output depends on: its depth,
+whether it renders compact and, for code lines, the sibling line after it.
+When a new version is rendered, the blocks whose key is unchanged are grafted
+from the previous tree together with their rendered output, so only the blocks
+around an edit are parsed and rendered again before the output is joined.
+"""
+
+from .cache import Cache
+from .constants import OPERATORS
+from .haml import HAML
+from .node import IncludeNode, Node
+from .parser import Source, build, tokenize
+from .target import Default
+import hashlib
+
+class Incremental(object):
+    """Renders versions of one template with ``render``.
+
+    The same target instance renders every version, so the loop counters of
+    the ``Underscore`` target keep increasing from one version to the next
+    instead of starting over; the output is otherwise the same as rendering
+    the version from scratch. ``parsed`` and ``reused`` count the blocks built
+    and grafted by the last render, and ``skipped`` the lines it skipped
+    without parsing them (see ``parser.build``).
+    """
+
+    def __init__(self, target=Default, compact=False, loader=None):
+        self.parser = HAML('', target=target, cache=Cache(), compact=compact, loader=loader)
+
+        # key -> rendered node, and the key every node was built for
+        self._blocks = {}
+        self._keys = {}
+
+        self.parsed = 0
+        self.reused = 0
+        self.skipped = 0
+
+    def render(self, haml):
+        self.parser.haml = haml
+        self.parser.sha1 = hashlib.sha1(haml).hexdigest()
+
+        source = Source(haml)
+        blocks = _Blocks(self, source)
+        stats = {}
+        root = build(Node(self.parser, ''), tokenize(source), source, blocks, stats)
+
+        self.parsed = blocks.parsed
+        self.reused = blocks.reused
+        self.skipped = stats['skipped']
+
+        _render(root)
+
+        # Only the blocks of this version can be grafted into the next one.
+        self._blocks = {}
+        keys = {}
+
+        for node, reusable in _walk(root):
+            key = self._keys.get(node)
+
+            if key is not None:
+                keys[node] = key
+
+                if reusable:
+                    self._blocks[key] = node
+
+        self._keys = keys
+
+        return ''.join(root.iter_html())
+
+class _Blocks(object):
+    """Looks up the blocks of one version for ``parser.build``."""
+
+    def __init__(self, incremental, source):
+        self.incremental = incremental
+        self.lines = source.lines
+        self.last = _last_lines(source)
+
+        self.parsed = 0
+        self.reused = 0
+
+        self._pending = None
+
+        # A node can only be grafted once, as it keeps its place among its
+        # siblings; repeated blocks are built again.
+        self._grafted = set()
+
+    def key(self, parent, lineno):
+        lines = self.lines[lineno - 1:self.last[lineno]]
+
+        # A multiline line can take its continuation from outside its block.
+        if lines[0].rstrip().endswith(OPERATORS['multiline']):
+            return None
+
+        following = None
+
+        # A code block ends differently depending on the block after it.
+        if lines[0].lstrip().startswith(OPERATORS['code']):
+            following = self.lines[self.last[lineno]:self.last[lineno] + 1]
+
+        compact = parent.compact and not parent.preserve
+        text = '\n'.join(lines)
+
+        return parent.indentation + 1, compact, hashlib.sha1(text).digest(), tuple(following or ())
+
+    def lookup(self, parent, lineno):
+        key = self.key(parent, lineno)
+        node = self.incremental._blocks.get(key)
+
+        if node is None or node in self._grafted:
+            self._pending = key
+            return None
+
+        self._grafted.add(node)
+        self.reused += 1
+        self.incremental._keys[node] = key
+
+        return node, self.last[lineno]
+
+    def created(self, node, lineno):
+        self.parsed += 1
+        self.incremental._keys[node] = self._pending
+
+def _last_lines(source):
+    """Maps the number of every non-empty line to the number of the last line
+    of the block it starts."""
+
+    last = {}
+    stack = []
+
+    for lineno, indentation, _ in tokenize(source):
+        while stack and stack[-1][1] >= indentation:
+            last[stack.pop()[0]] = lineno - 1
+
+        stack.append((lineno, indentation))
+
+    for lineno, _ in stack:
+        last[lineno] = len(source.lines)
+
+    return last
+
+def _walk(root):
+    """Yields every node under ``root`` with whether its output can be reused,
+    which is not the case for includes or anything around them."""
+
+    nodes = []
+    stack = list(root.children)
+
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        stack.extend(node.children)
+
+    reusable = {}
+
+    for node in reversed(nodes):
+        reusable[node] = not isinstance(node, IncludeNode) and all(reusable[child] for child in node.children)
+
+    for node in nodes:
+        yield node, reusable[node]
+
+def _render(root):
+    # Children first, so that every node is rendered from the output of its
+    # children and grafted blocks are not rendered again.
+    nodes = []
+    stack = list(root.children)
+
+    while stack:
+        node = stack.pop()
+
+        if node.fragment is None and node.RENDER:
+            nodes.append(node)
+            stack.extend(node.children)
+
+    for node in reversed(nodes):
+        node.fragment = ''.join(node.iter_html())
@@ -0,0 +1,200 @@
+"""Opt-in instrumentation of parsing and rendering.
+
+Instrumentation is off until a hook is added with ``add``. Templates created
+while hooks are installed report to them; every other template only pays for
+checking that there are none, once when it is created. A hook is any object
+with the methods of ``Hook``; ``Collector`` is a hook that sums up what it is
+told::
+
+    with instrument.collecting() as collector:
+        HAML(haml).to_html()
+
+    collector.report()
+
+Hooks are told about:
+
+* every parse and every render that was not a cache hit, with the time it
+  took, the number of nodes and of skipped lines and the size of the output;
+* every node built while parsing, with the time building it took;
+* every element line parsed while rendering, with the time it took;
+* every call to the ``block`` and ``eval`` methods of the target.
+"""
+
+import contextlib
+import time
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+_HOOKS = []
+
+class Hook(object):
+    """The methods a hook can implement. All of them do nothing here."""
+
+    def parsed(self, template, seconds, nodes, skipped):
+        """``template``, a ``HAML``, was parsed into ``nodes`` nodes, skipping
+        ``skipped`` lines that are never rendered."""
+
+    def rendered(self, template, seconds, size):
+        """``template`` was rendered into ``size`` characters of output."""
+
+    def node(self, cls, seconds):
+        """A node of class ``cls`` was built."""
+
+    def element(self, seconds):
+        """The element line of an ``HTMLNode`` was parsed."""
+
+    def target(self, method, seconds):
+        """The ``block`` or ``eval`` method of a target was called."""
+
+def add(hook):
+    """Makes templates created from now on report to ``hook``."""
+
+    if hook not in _HOOKS:
+        _HOOKS.append(hook)
+
+def remove(hook):
+    if hook in _HOOKS:
+        _HOOKS.remove(hook)
+
+def active():
+    """Returns the installed hooks, or ``None`` when there are none."""
+
+    return tuple(_HOOKS) if _HOOKS else None
+
+@contextlib.contextmanager
+def collecting(collector=None):
+    """Installs a ``Collector`` (or ``collector``) for the duration of a
+    ``with`` block and yields it."""
+
+    collector = Collector() if collector is None else collector
+    add(collector)
+
+    try:
+        yield collector
+    finally:
+        remove(collector)
+
+def timed_create(create, hooks):
+    """Returns ``create`` for ``parser.build``, telling ``hooks`` about every
+    node it builds."""
+
+    def timed(parser, haml, parent=None, indentation=-1):
+        start = _clock()
+        node = create(parser, haml, parent, indentation)
+        seconds = _clock() - start
+
+        for hook in hooks:
+            hook.node(type(node), seconds)
+
+        return node
+
+    return timed
+
+def timed_element(cls, node, hooks):
+    start = _clock()
+    element = cls(node)
+    seconds = _clock() - start
+
+    for hook in hooks:
+        hook.element(seconds)
+
+    return element
+
+def instrument_target(target, hooks):
+    """Replaces the ``block`` and ``eval`` methods of the ``target`` instance
+    with ones telling ``hooks`` about every call."""
+
+    for name in ('block', 'eval'):
+        setattr(target, name, _timed_method(getattr(target, name), name, hooks))
+
+def _timed_method(method, name, hooks):
+    def timed(*args):
+        start = _clock()
+        result = method(*args)
+        seconds = _clock() - start
+
+        for hook in hooks:
+            hook.target(name, seconds)
+
+        return result
+
+    return timed
+
+class Collector(Hook):
+    """Sums up the events of every template it is told about.
+
+    ``templates`` maps the sha1 of every template to its parse and render
+    counts and times, node and skipped line counts and output size;
+    ``nodes``, ``elements`` and ``targets`` hold ``[count, seconds]`` per
+    node class name, for element lines and per target method.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.templates = {}
+        self.nodes = {}
+        self.elements = [0, 0.0]
+        self.targets = {}
+
+    def _template(self, template):
+        stats = self.templates.get(template.sha1)
+
+        if stats is None:
+            stats = self.templates[template.sha1] = {
+                'parses': 0,
+                'parse_seconds': 0.0,
+                'renders': 0,
+                'render_seconds': 0.0,
+                'nodes': 0,
+                'skipped': 0,
+                'size': 0,
+            }
+
+        return stats
+
+    def parsed(self, template, seconds, nodes, skipped):
+        stats = self._template(template)
+        stats['parses'] += 1
+        stats['parse_seconds'] += seconds
+        stats['nodes'] = nodes
+        stats['skipped'] = skipped
+
+    def rendered(self, template, seconds, size):
+        stats = self._template(template)
+        stats['renders'] += 1
+        stats['render_seconds'] += seconds
+        stats['size'] = size
+
+    def node(self, cls, seconds):
+        _add(self.nodes, cls.__name__, seconds)
+
+    def element(self, seconds):
+        self.elements[0] += 1
+        self.elements[1] += seconds
+
+    def target(self, method, seconds):
+        _add(self.targets, method, seconds)
+
+    def report(self):
+        """Returns everything collected as a dict of plain values."""
+
+        return {
+            'templates': dict((sha1, dict(stats)) for sha1, stats in self.templates.items()),
+            'nodes': _counters(self.nodes),
+            'elements': {'count': self.elements[0], 'seconds': self.elements[1]},
+            'targets': _counters(self.targets),
+        }
+
+def _add(counters, key, seconds):
+    counter = counters.get(key)
+
+    if counter is None:
+        counter = counters[key] = [0, 0.0]
+
+    counter[0] += 1
+    counter[1] += seconds
+
+def _counters(counters):
+    return dict((key, {'count': count, 'seconds': seconds}) for key, (count, seconds) in counters.items())
@@ -0,0 +1,111 @@
+"""A target independent form of a compiled template.
+
+``compile`` parses a template once into a flat tuple of instructions that
+only holds strings, tuples and ``None``, so it can be stored with ``marshal``
+or ``pickle``. ``render`` turns it into the output of any ``Default`` target
+without parsing the template again. Instructions are either literal text or
+one of::
+
+    ('eval', expression)
+    ('open', keyword, expression, keyword of the next sibling block or None)
+    ('close',)
+
+where each ``close`` ends the innermost ``open`` that is still open.
+"""
+
+from .constants import INDENT
+from .haml import HAML
+from .parser import fold, parse
+from .target import Default
+import re
+
+_MARKER = re.compile('\x00(\\d+)\x00')
+
+class _Recorder(Default):
+    """Stands in for a target while compiling, leaving a marker in the output
+    for every expression and block instead of rendering it."""
+
+    def __init__(self):
+        self.instructions = []
+
+    def _marker(self, instruction):
+        self.instructions.append(instruction)
+        return '\x00%d\x00' % (len(self.instructions) - 1)
+
+    def block(self, node, keyword, expression):
+        sibling = getattr(node.get_sibling(1), 'keyword', None)
+        return self._marker(('open', keyword, expression, sibling)), self._marker(('close',))
+
+    def eval(self, input):
+        return self._marker(('eval', input))
+
+class _Block(object):
+    """The part of a ``CodeNode`` that targets look at when closing a block."""
+
+    __slots__ = ('keyword', 'sibling')
+
+    def __init__(self, keyword, sibling=None):
+        self.keyword = keyword
+        self.sibling = sibling
+
+    def get_sibling(self, n):
+        if n == 1 and self.sibling is not None:
+            return _Block(self.sibling)
+
+        return None
+
+def compile(haml, compact=False, loader=None, indentation=0):
+    """Parses ``haml`` into a tuple of instructions for ``render``.
+
+    With ``indentation`` the template renders as if its lines were nested that
+    deep in another template, which is how includes are compiled.
+    """
+
+    if '\x00' in haml:
+        raise ValueError('templates cannot contain NUL characters')
+
+    parser = HAML(haml, target=_Recorder, compact=compact, loader=loader)
+
+    if indentation:
+        prefix = ' ' * (indentation * INDENT)
+        haml = '\n'.join(prefix + line if line else line for line in haml.split('\n'))
+
+    root = fold(parse(parser, haml, indentation))
+    parts = _MARKER.split(''.join(root.iter_html()))
+    instructions = []
+
+    for i, part in enumerate(parts):
+        if i % 2:
+            instructions.append(parser.target.instructions[int(part)])
+        elif part:
+            instructions.append(part)
+
+    return tuple(instructions)
+
+def walk(instructions, target=Default):
+    """Yields ``(kind, output)`` for every instruction rendered with ``target``,
+    where ``kind`` is ``'text'``, ``'eval'`` or ``'block'``."""
+
+    if isinstance(target, type):
+        target = target()
+
+    closes = []
+
+    for instruction in instructions:
+        if isinstance(instruction, basestring):
+            yield 'text', instruction
+        elif instruction[0] == 'eval':
+            yield 'eval', target.eval(instruction[1])
+        elif instruction[0] == 'open':
+            _, keyword, expression, sibling = instruction
+            open, close = target.block(_Block(keyword, sibling), keyword, expression)
+            closes.append(close.strip())
+            yield 'block', open.strip()
+        else:
+            yield 'block', closes.pop()
+
+def render(instructions, target=Default):
+    """Renders the output of ``compile`` with ``target``, a ``Default``
+    subclass or instance."""
+
+    return ''.join([output for _, output in walk(instructions, target)])
@@ -0,0 +1,62 @@
+"""Compiles templates into JavaScript functions for the ``Underscore`` target.
+
+Instead of ``<% %>`` template text that the browser has to compile with
+``_.template``, ``compile`` returns the source of the function ``_.template``
+would have built: ``function (obj) { ... }`` returning the rendered string.
+Code blocks are the ones the ``Underscore`` target emits, including its
+``_i``/``_length`` loop counters, and ``=`` values are output as ``<%= %>``
+outputs them (unescaped, with ``null`` and ``undefined`` as empty strings).
+
+``bundle`` writes many compiled templates into a single JavaScript module.
+"""
+
+from . import ir
+from .target import Underscore
+import json
+
+class _Code(Underscore):
+    """The ``Underscore`` target without the ``<% %>`` delimiters."""
+
+    CONTROL = '%s'
+    EVAL = '%s'
+
+def _string(text):
+    # A JavaScript string literal that is also safe inside a <script> tag.
+    return json.dumps(text).replace('</', '<\\/')
+
+def generate(instructions):
+    """Returns the source of a JavaScript function for IR ``instructions``."""
+
+    body = []
+
+    for kind, output in ir.walk(instructions, _Code):
+        if kind == 'text':
+            body.append('__p+=%s;' % _string(output))
+        elif kind == 'eval':
+            body.append("__p+=((__t=(%s))==null?'':__t);" % output)
+        elif output:
+            body.append(output)
+
+    return "function(obj){var __t,__p='';with(obj||{}){%s}return __p;}" % '\n'.join(body)
+
+def compile(haml, compact=False, loader=None):
+    """Returns the source of a JavaScript function rendering ``haml``."""
+
+    return generate(ir.compile(haml, compact, loader))
+
+def bundle(templates, name='JST', loader=None):
+    """Returns a JavaScript module with the compiled ``templates``, a list of
+    ``(name, haml)`` pairs. The module exports an object mapping each name to
+    its function, through ``module.exports`` where there is one and as the
+    global ``name`` otherwise. Includes are resolved with ``loader``."""
+
+    lines = ['(function(root){', 'var templates={};']
+
+    for template, haml in templates:
+        lines.append('templates[%s]=%s;' % (_string(template), compile(haml, loader=loader)))
+
+    lines.append("if(typeof module==='object'&&module.exports){module.exports=templates;}"
+                 "else{root[%s]=templates;}" % _string(name))
+    lines.append('})(this);')
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,326 @@
+from .cache import Cache
+from .constants import OPERATORS
+from .haml import HAML
+from .parser import Source
+from .target import Default, Tornado
+from . import ir
+import hashlib
+import os
+import posixpath
+
+try:
+    import tornado.template
+except ImportError:
+    tornado = None
+
+_INCLUDE = OPERATORS['include']
+
+class Loader(object):
+    """Loads templates by name from a directory, in the style of
+    ``tornado.template.Loader``.
+
+    Names are paths relative to ``root``, with or without ``extension``.
+    ``compile`` returns the output of a template for the loader's ``target``
+    and keeps it until the template changes. With ``check`` every lookup
+    compares the modification time and size of the template and everything
+    it includes with the ones it was read with; in production ``check`` can
+    be turned off, so that lookups never touch the filesystem.
+
+    The loader resolves the ``+ name`` includes of the templates it loads: every
+    included template is compiled once per nesting depth into the target
+    independent IR (see ``haiku.ir``), which every template including it
+    reuses. The loader also records which templates include which, so that
+    ``invalidate`` drops the cached output of exactly the templates that
+    depend on a changed one. The hashes of the included templates are part of
+    the cache key of a template, so a cache shared with other loaders or
+    processes never returns output rendered with an older partial.
+    """
+
+    def __init__(self, root, extension='.haml', target=Default, compact=False, cache=None, check=True):
+        self.root = os.path.abspath(root)
+        self.extension = extension
+        self.target = target
+        self.compact = compact
+        self.cache = Cache() if cache is None else cache
+        self.check = check
+
+        self._sources = {}
+
+        # name -> sha1 of the source that was read
+        self._hashes = {}
+
+        # name -> (modification time, size) of the source that was read
+        self._stats = {}
+
+        # name -> output of ``compile``
+        self._compiled = {}
+
+        # (name, indentation, compact) -> instructions
+        self._partials = {}
+
+        # name -> {sha1 of an including template: its cache}
+        self._dependents = {}
+
+        # sha1 of a template -> names on its "+ name" lines
+        self._includes = {}
+
+        # sha1 of a template loaded by name -> name
+        self._names = {}
+
+        self._including = set()
+
+    def resolve(self, name):
+        if not name.endswith(self.extension):
+            name += self.extension
+
+        path = os.path.abspath(os.path.join(self.root, name))
+
+        if not path.startswith(self.root + os.sep):
+            raise ValueError('%r is outside of %s' % (name, self.root))
+
+        return path
+
+    def _stat(self, name):
+        try:
+            stat = os.stat(self.resolve(name))
+        except OSError:
+            return None
+
+        return stat.st_mtime, stat.st_size
+
+    def _changed(self, name):
+        names = [name] + list(self.dependencies(name))
+        return [dependency for dependency in names
+                if dependency in self._sources and self._stats.get(dependency) != self._stat(dependency)]
+
+    def _refresh(self, name):
+        # Only the file system is looked at: the includes of every template
+        # were recorded when it was read.
+        if self.check:
+            for changed in self._changed(name):
+                self.invalidate(changed)
+
+    def fresh(self, name):
+        """Whether template ``name`` and everything it includes are unchanged
+        since they were read. Always true without ``check``."""
+
+        return not self.check or not self._changed(name)
+
+    def read(self, name):
+        source = self._sources.get(name)
+
+        if source is None:
+            with open(self.resolve(name), 'rb') as f:
+                stat = os.fstat(f.fileno())
+                source = self._sources[name] = f.read()
+
+            self._stats[name] = stat.st_mtime, stat.st_size
+            sha1 = self._hashes[name] = hashlib.sha1(source).hexdigest()
+            self._includes[sha1] = _included(source)
+
+        return source
+
+    def load(self, name, target=None, cache=None, compact=None):
+        """Returns the ``HAML`` template ``name``. The loader's ``target``,
+        ``cache`` and ``compact`` are used unless given."""
+
+        self._refresh(name)
+        return self._load(name, target, cache, compact)
+
+    def _load(self, name, target=None, cache=None, compact=None):
+        haml = HAML(self.read(name),
+                    target=self.target if target is None else target,
+                    cache=self.cache if cache is None else cache,
+                    compact=self.compact if compact is None else compact,
+                    loader=self)
+        self._names[haml.sha1] = name
+
+        return haml
+
+    def compile(self, name):
+        """Returns the output of template ``name``."""
+
+        self._refresh(name)
+        return self._compile(name)
+
+    def _compile(self, name):
+        html = self._compiled.get(name)
+
+        if html is None:
+            html = self._compiled[name] = self._load(name).to_html()
+
+        return html
+
+    def include(self, name, parser, indentation=0, compact=False):
+        """Renders template ``name`` for an include in the template ``parser``
+        at ``indentation``."""
+
+        key = (name, indentation, compact)
+        instructions = self._partials.get(key)
+
+        if instructions is None:
+            if name in self._including:
+                raise ValueError('%r includes itself' % name)
+
+            self._including.add(name)
+
+            try:
+                source = self.read(name)
+                instructions = ir.compile(source, compact, loader=self, indentation=indentation)
+            finally:
+                self._including.discard(name)
+
+            self._names[self._hashes[name]] = name
+            self._partials[key] = instructions
+
+        self._dependents.setdefault(name, {})[parser.sha1] = parser.cache
+
+        return ir.render(instructions, parser.target)
+
+    def dependencies(self, name):
+        """Returns the names of every template that template ``name`` includes,
+        directly or through other includes, as of when they were read."""
+
+        self.read(name)
+        return self._closure(self._includes[self._hashes[name]])
+
+    def digest(self, template):
+        """Returns the ``(name, sha1)`` pairs of every template that
+        ``template``, a ``HAML``, includes, directly or through other
+        includes, in a stable order. They are part of its cache key."""
+
+        includes = self._includes.get(template.sha1)
+
+        if includes is None:
+            includes = self._includes[template.sha1] = _included(template.haml)
+
+        if not includes:
+            return ()
+
+        return tuple(sorted((name, self._hashes[name]) for name in self._closure(includes)))
+
+    def _closure(self, includes):
+        # Names on "+ name" lines in filters or comments may not be templates.
+        names = set()
+        pending = list(includes)
+
+        while pending:
+            name = pending.pop()
+
+            if name in names:
+                continue
+
+            try:
+                self.read(name)
+            except (IOError, OSError, ValueError):
+                continue
+
+            names.add(name)
+            pending.extend(self._includes[self._hashes[name]])
+
+        return names
+
+    def invalidate(self, name):
+        """Forgets template ``name`` and drops the cached output of every
+        template that includes it, directly or through other includes."""
+
+        pending = [name]
+        seen = set()
+
+        while pending:
+            name = pending.pop()
+
+            if name in seen:
+                continue
+
+            seen.add(name)
+            self._sources.pop(name, None)
+            self._stats.pop(name, None)
+            self._hashes.pop(name, None)
+            self._compiled.pop(name, None)
+
+            for key in [key for key in self._partials if key[0] == name]:
+                del self._partials[key]
+
+            for sha1, cache in self._dependents.pop(name, {}).items():
+                cache.invalidate(sha1)
+
+                if sha1 in self._names:
+                    pending.append(self._names[sha1])
+
+    def reset(self):
+        """Forgets every template."""
+
+        self._sources.clear()
+        self._stats.clear()
+        self._hashes.clear()
+        self._compiled.clear()
+        self._partials.clear()
+        self._dependents.clear()
+        self._includes.clear()
+        self._names.clear()
+
+def _included(haml):
+    """Returns the names on the ``+ name`` lines of ``haml``, a string or a
+    ``Source``."""
+
+    if isinstance(haml, Source):
+        lines = haml.lines
+    elif _INCLUDE in haml:
+        lines = haml.split('\n')
+    else:
+        return frozenset()
+
+    names = set()
+
+    for line in lines:
+        line = line.strip()
+
+        if line.startswith(_INCLUDE):
+            names.add(line[len(_INCLUDE):].strip())
+
+    return frozenset(names)
+
+if tornado is not None:
+    class TornadoLoader(tornado.template.BaseLoader):
+        """A ``tornado.template`` loader for HAML templates, to pass as the
+        ``template_loader`` of a Tornado application.
+
+        Templates are rendered with the ``Tornado`` target by a ``Loader`` for
+        ``root`` and compiled by Tornado, which keeps the compiled template
+        until the template or one of its includes changes. Other keyword
+        arguments are those of ``tornado.template.Loader``.
+        """
+
+        def __init__(self, root, extension='.haml', compact=False, check=True, **kwargs):
+            super(TornadoLoader, self).__init__(**kwargs)
+            self.haiku = Loader(root, extension=extension, target=Tornado, compact=compact, check=check)
+
+        def reset(self):
+            super(TornadoLoader, self).reset()
+            self.haiku.reset()
+
+        def resolve_path(self, name, parent_path=None):
+            # Names in ``{% extends %}`` and ``{% include %}`` are relative to
+            # the template they are in, as with ``tornado.template.Loader``.
+            if parent_path and not name.startswith('/'):
+                name = posixpath.normpath(posixpath.join(posixpath.dirname(parent_path), name))
+
+            return name
+
+        def load(self, name, parent_path=None):
+            path = self.resolve_path(name, parent_path=parent_path)
+
+            # The output is dropped when the template or one of its includes
+            # changes, whichever template the change was noticed through.
+            self.haiku._refresh(path)
+
+            if path not in self.haiku._compiled:
+                with self.lock:
+                    self.templates.pop(path, None)
+
+            return super(TornadoLoader, self).load(name, parent_path=parent_path)
+
+        def _create_template(self, name):
+            # ``load`` has just checked the files.
+            return tornado.template.Template(self.haiku._compile(name), name=name, loader=self)
@@ -0,0 +1,138 @@
+"""Compiles templates into Python functions instead of another engine's syntax.
+
+``Template(haml).render(context)`` runs a function generated from the
+template's IR (see ``haiku.ir``): code lines become Python statements, and
+``=`` evaluations, ``#{}`` interpolations and evaluated attributes become
+expressions whose values are escaped with ``utils.xhtml_escape``, like
+Tornado's autoescaping. Expressions are Python, looked up in the context and
+then in the builtins. Output is utf-8 encoded, as Tornado's is.
+"""
+
+from . import ir
+import types
+
+# Keywords that open an indented block of code.
+COMPOUND = ('for', 'if', 'elif', 'else', 'while', 'with', 'try', 'except', 'finally')
+
+# Blocks that can continue into the given sibling block.
+CONTINUATION = {
+    'if': ('elif', 'else'),
+    'elif': ('elif', 'else'),
+    'try': ('except', 'finally'),
+    'except': ('except', 'else', 'finally'),
+}
+
+_FUNCTION = '_haiku_render'
+
+def _escape(value):
+    # utils.xhtml_escape over utf-8 bytes, with chained replaces in place of
+    # the regular expression since it runs for every value a render outputs.
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    elif not isinstance(value, str):
+        if value is None:
+            return ''
+
+        value = str(value)
+
+    return value.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;')
+
+def generate(instructions):
+    """Returns the Python source of a render function for IR ``instructions``."""
+
+    lines = [
+        'def %s(_haiku_escape=_haiku_escape):' % _FUNCTION,
+        '    _haiku_buffer = []',
+        '    _haiku_append = _haiku_buffer.append',
+        '    _haiku_extend = _haiku_buffer.extend',
+    ]
+
+    depth = 1
+    blocks = []
+    continued = False
+
+    # Consecutive output is added to the buffer with a single call.
+    output = []
+
+    def flush():
+        if len(output) == 1:
+            lines.append('%s_haiku_append(%s)' % ('    ' * depth, output[0]))
+        elif output:
+            lines.append('%s_haiku_extend((%s))' % ('    ' * depth, ', '.join(output)))
+
+        del output[:]
+
+    for instruction in instructions:
+        if isinstance(instruction, basestring):
+            if isinstance(instruction, unicode):
+                instruction = instruction.encode('utf-8')
+
+            output.append(repr(instruction))
+            continue
+
+        if instruction[0] == 'eval':
+            output.append('_haiku_escape(%s)' % instruction[1])
+            continue
+
+        flush()
+        indent = '    ' * depth
+
+        if instruction[0] == 'open':
+            _, keyword, expression, sibling = instruction
+            blocks.append((keyword, sibling))
+
+            if keyword not in COMPOUND:
+                if keyword == 'set':
+                    lines.append(indent + expression)
+                else:
+                    lines.append(indent + ' '.join(filter(bool, (keyword, expression))))
+
+                continue
+
+            # A continuing block replaces the previous one at the same depth.
+            if continued:
+                depth -= 1
+                indent = '    ' * depth
+
+            lines.append('%s%s:' % (indent, ' '.join(filter(bool, (keyword, expression)))))
+            lines.append('%s    pass' % indent)
+            depth += 1
+            continued = False
+        else:
+            keyword, sibling = blocks.pop()
+
+            if keyword in COMPOUND:
+                continued = sibling in CONTINUATION.get(keyword, ())
+
+                if not continued:
+                    depth -= 1
+
+    flush()
+    lines.append('    return "".join(_haiku_buffer)')
+
+    return '\n'.join(lines) + '\n'
+
+class Template(object):
+    """A template compiled into a Python function."""
+
+    def __init__(self, haml, compact=False, name='<haml>', loader=None):
+        self.name = name
+        self.source = generate(ir.compile(haml, compact, loader))
+
+        namespace = {'_haiku_escape': _escape}
+        exec(compile(self.source, name, 'exec'), namespace)
+
+        function = namespace.pop(_FUNCTION)
+        self._code = function.__code__
+        self._defaults = function.__defaults__
+        self._namespace = namespace
+
+    def render(self, context=None, **kwargs):
+        namespace = dict(self._namespace)
+
+        if context:
+            namespace.update(context)
+
+        namespace.update(kwargs)
+
+        return types.FunctionType(self._code, namespace, self.name, self._defaults)()
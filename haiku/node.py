@@ -1,190 +1,298 @@
 import re
 from .constants import OPERATORS, INDENT
-from .element import HTMLElement
-from . import utils
+from .element import HTMLElement, BLOCK, PRESERVE, parse_line
+from . import instrument, utils
 
-class StripOuter(Exception):
-    def __init__(self, html, *args, **kwargs):
-        super(StripOuter, self).__init__(*args, **kwargs)
-        self.html = html
+_NEWLINE = '\n'
+
+# How the output of a node is joined with its siblings; see
+# ``Node.resolve_whitespace``.
+_LSTRIP = 1
+_RSTRIP = 2
+_SEPARATE = 4
+
+# Maps the first character of a line to the (operator, node class) pairs that
+# could match it, longest operator first.
+_NODES = {}
+
+def register(*operators):
+    """Class decorator making ``Node.create`` build the class for lines that
+    start with any of ``operators``. Registering an operator again replaces
+    the previous class."""
+
+    def decorator(cls):
+        for operator in operators:
+            candidates = [c for c in _NODES.get(operator[0], []) if c[0] != operator]
+            candidates.append((operator, cls))
+            candidates.sort(key=lambda candidate: -len(candidate[0]))
+
+            _NODES[operator[0]] = candidates
+
+        return cls
+
+    return decorator
 
 class Node(object):
+    __slots__ = ('parser', 'haml', 'parent', 'children', 'index', 'indentation', 'fragment', 'whitespace')
+
     PARSE = True
+    RENDER = True
+
+    @staticmethod
+    def classify(haml):
+        """Returns the node class for a stripped line of HAML."""
+
+        for operator, cls in _NODES.get(haml[:1], ()):
+            if haml.startswith(operator):
+                return cls
+
+        return RawNode
 
     @staticmethod
-    def create(parser, haml, nested_haml='', parent=None, indentation=-1):
+    def create(parser, haml, parent=None, indentation=-1):
         haml = haml.strip()
+        return Node.classify(haml)(parser, haml, parent, indentation=indentation)
 
-        NODES = [
-            (HAMLComment, '-#'),
-            (HTMLCommentNode, '/'),
-            (HTMLNode, ('#', '.', '%')),
-            (CodeNode, '-'),
-            (EvalNode, ('=', '>=')),
-            (DoctypeNode, '!!!'),
-            (RawNode, ('\\', '>')),
-
-            # Filters
-            (PlainFilterNode, ':plain'),
-            (JavaScriptFilterNode, ':javascript'),
-            (CssFilterNode, ':css'),
-            (CdataFilterNode, ':cdata'),
-            (EscapedFilterNode, ':escaped'),
-        ]
-
-        for cls, operators in NODES:
-            if not isinstance(operators, tuple):
-                operators = (operators,)
-
-            for operator in operators:
-                if haml.startswith(operator):
-                    return cls(parser, haml, nested_haml, parent, indentation=indentation)
-
-        return RawNode(parser, haml, nested_haml, parent, indentation=indentation)
-
-    def __init__(self, parser, haml, nested_haml='', parent=None, indentation=-1):
+    def __init__(self, parser, haml, parent=None, indentation=-1):
         self.parser = parser
         self.haml = haml
-        self.nested_haml = nested_haml
         self.parent = parent
-        self.siblings = {
-            'left': [],
-            'right': []
-        }
         self.children = []
+        self.index = 0
         self.indentation = indentation
 
-        if not self.PARSE:
-            return
+        # The output of a static subtree, once folded (see ``parser.fold``).
+        self.fragment = None
 
-        if isinstance(nested_haml, list):
-            lines = nested_haml
-        else:
-            lines = [line for line in nested_haml.split('\n') if line]
+        # Set by the parent's ``resolve_whitespace``.
+        self.whitespace = 0
 
-        while lines:
-            line = lines.pop(0)
+    def add_child(self, node):
+        node.index = len(self.children)
+        self.children.append(node)
 
-            line_indentation = utils.indentation(line)
+    def get_sibling(self, n):
+        if not n or self.parent is None:
+            return None
 
-            MULTILINE = OPERATORS['multiline']
+        index = self.index + n
+        siblings = self.parent.children
 
-            if line.rstrip().endswith(MULTILINE):
-                m_lines = [line.rstrip()]
+        if 0 <= index < len(siblings):
+            return siblings[index]
 
-                while True:
-                    try:
-                        if lines[0].endswith(MULTILINE):
-                            m_lines.append(lines.pop(0).rstrip())
-                        else:
-                            break
-                    except IndexError:
-                        break
+        return None
 
-                line = self._indent(' '.join(line.rstrip(MULTILINE).strip() for line in m_lines), line_indentation)
+    def _indent(self, line, indentation=None):
+        if self.compact:
+            return line
 
-            nested_lines = []
+        return utils.indent(line, indentation or self.indentation)
 
-            while True:
-                if not lines:
-                    break
+    @property
+    def outerstrip(self):
+        """Whether whitespace around this node is removed (the ``>`` operator)."""
 
-                try:
-                    if utils.indentation(lines[0]) <= line_indentation:
-                        break
-                    else:
-                        nested_lines.append(lines.pop(0))
-                except IndexError:
-                    break
+        return False
 
-            node = Node.create(self.parser, line, nested_lines, parent=self, indentation=self.indentation + 1)
+    @property
+    def static(self):
+        """Whether this node's own output never depends on the target, so a
+        subtree of static nodes always renders the same."""
 
-            for child in self.children:
-                node.add_sibling('left', child)
-                child.add_sibling('right', node)
+        return False
 
-            self.children.append(node)
+    @property
+    def block(self):
+        """Whether whitespace next to this node is insignificant in compact output."""
 
-    def add_sibling(self, location, sibling):
-        location = location.lower()
-        assert location in ('left', 'right')
-        self.siblings[location].append(sibling)
+        return False
 
-    def get_sibling(self, n):
-        if n < 0:
-            siblings = self.siblings['left']
-        elif n > 0:
-            siblings = self.siblings['right']
-        else:
-            return None
+    @property
+    def preserve(self):
+        """Whether this node's content is rendered as is in compact output."""
 
-        if not len(siblings):
-            return None
+        return False
 
-        n = abs(n) - 1
+    @property
+    def compact(self):
+        """Whether this node is rendered without indentation or whitespace
+        between block tags (the ``compact`` option)."""
 
-        if n > len(siblings):
-            return None
+        if not self.parser.options.get('compact'):
+            return False
 
-        return siblings[n]
+        parent = self.parent
 
-    def _indent(self, line, indentation=None):
-        return utils.indent(line, indentation or self.indentation)
+        while parent is not None:
+            if parent.preserve:
+                return False
+
+            parent = parent.parent
+
+        return True
+
+    def resolve_whitespace(self):
+        """Works out once, after parsing, how the output of every child is
+        joined with its siblings: a ``>`` node loses the whitespace around
+        it, the node before it its trailing whitespace and the node after it
+        its leading whitespace, and a newline separates siblings except in
+        compact output between two block nodes. Skipped nodes (HAML comments)
+        are neither the node before nor the node after another."""
+
+        children = self.children
+        length = len(children)
+        outerstrip = [child.outerstrip for child in children]
+
+        # Whether the rendered node before every child strips its whitespace.
+        preceding = []
+        stripping = False
+
+        for i, child in enumerate(children):
+            preceding.append(stripping)
+
+            if child.RENDER:
+                stripping = outerstrip[i]
+
+        following = False
+        block = False
+        compact = length > 1 and children[0].compact
+
+        for i in range(length - 1, -1, -1):
+            child = children[i]
+            rstrip = following
+            joined = False
 
-    def render_children(self):
-        rendered_children = []
+            if child.RENDER:
+                following = outerstrip[i]
 
-        outerstrip = False
-        length = len(self.children)
+                if compact:
+                    joined = block and child.block
+                    block = child.block
 
-        for i, child in enumerate(self.children):
-            lstrip = outerstrip
+            if outerstrip[i]:
+                whitespace = _LSTRIP | _RSTRIP
+            else:
+                whitespace = 0
 
-            try:
-                html = child.to_html()
-                outerstrip = False
-            except StripOuter as so:
-                html = so.html
-                outerstrip = True
+                if preceding[i]:
+                    whitespace |= _LSTRIP
 
-                if rendered_children:
-                    rendered_children[-1] = rendered_children[-1].rstrip()
+                if rstrip:
+                    whitespace |= _RSTRIP
+                elif i < length - 1 and not joined:
+                    whitespace |= _SEPARATE
+
+            child.whitespace = whitespace
+
+    def iter_children(self):
+        for child in self.children:
+            if not child.RENDER:
+                continue
+
+            whitespace = child.whitespace
+
+            if child.fragment is not None:
+                fragment = child.fragment
+
+                if whitespace & _LSTRIP:
+                    fragment = fragment.lstrip()
+
+                if whitespace & _RSTRIP:
+                    fragment = fragment.rstrip()
+
+                yield fragment
+            elif whitespace & (_LSTRIP | _RSTRIP):
+                for chunk in child.iter_stripped(whitespace & _LSTRIP, whitespace & _RSTRIP):
+                    yield chunk
+            else:
+                for chunk in child.iter_html():
+                    yield chunk
+
+            if whitespace & _SEPARATE:
+                yield _NEWLINE
+
+    def iter_stripped(self, lstrip, rstrip):
+        """Yields the output without its leading (``lstrip``) or trailing
+        (``rstrip``) whitespace. The output of a node without children is
+        short and joined before it is stripped, which copies nothing unless
+        there is whitespace to remove."""
+
+        if not self.children:
+            html = ''.join(self.iter_html())
 
             if lstrip:
                 html = html.lstrip()
 
-            if html is not None:
-                if outerstrip:
-                    rendered_children.append(html.strip())
-                else:
-                    if i < length - 1:
-                        html += '\n'
+            if rstrip:
+                html = html.rstrip()
 
-                    rendered_children.append(html)
+            yield html
+            return
 
-        return ''.join(rendered_children)
+        chunks = self.iter_html()
 
-    def to_html(self):
-        html = self.render_children()
+        if lstrip:
+            chunks = utils.lstrip_chunks(chunks)
 
-        if html:
-            html = re.sub(r'#\{(.*?)\}', self.parser.target.eval('\\1'), html + '\n')
+        if rstrip:
+            chunks = utils.rstrip_chunks(chunks)
 
-        return html
+        for chunk in chunks:
+            yield chunk
+
+    def iter_html(self):
+        empty = True
+
+        for chunk in self.iter_children():
+            if chunk:
+                empty = False
+                yield chunk
+
+        if not empty:
+            yield _NEWLINE
 
-class RawNode(Node):
     def to_html(self):
-        content = self.haml
+        if not self.RENDER:
+            return None
 
-        if content.startswith(OPERATORS['outerstrip']):
-            raise StripOuter(self._indent(content[1:]))
+        return ''.join(self.iter_html())
 
-        if content.startswith(OPERATORS['escape']):
+@register('\\', '>')
+class RawNode(Node):
+    __slots__ = ('content', 'interpolation')
+
+    def __init__(self, *args, **kwargs):
+        Node.__init__(self, *args, **kwargs)
+
+        content = self.haml
+
+        if self.outerstrip or content.startswith(OPERATORS['escape']):
             content = content[1:]
 
-        return self._indent(content)
+        self.content = content
+        self.interpolation = utils.split_interpolation(content)
+
+    @property
+    def outerstrip(self):
+        return self.haml.startswith(OPERATORS['outerstrip'])
+
+    @property
+    def static(self):
+        return self.interpolation is None
 
+    def iter_html(self):
+        content = self.content
+
+        if self.interpolation is not None:
+            content = utils.join_interpolation(self.interpolation, self.parser.target)
+
+        yield self._indent(content)
+
+@register('!!!')
 class DoctypeNode(Node):
+    __slots__ = ()
+
     DOCTYPES = {
         'Strict': '<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Strict//EN" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-strict.dtd">',
         'Frameset': '<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Frameset//EN" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-frameset.dtd">',
@@ -195,24 +303,77 @@ class DoctypeNode(Node):
         'XML': '<?xml version="1.0" encoding="utf-8" ?>',
     }
 
-    def to_html(self):
+    @property
+    def static(self):
+        return True
+
+    @property
+    def block(self):
+        return True
+
+    def iter_html(self):
         doctype = self.haml.lstrip(OPERATORS['doctype']).strip()
-        return self.DOCTYPES.get(doctype, '<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">')
+        yield self.DOCTYPES.get(doctype, '<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">')
 
+@register('#', '.', '%')
 class HTMLNode(Node):
-    def to_html(self):
-        indentation = self.indentation
+    __slots__ = ('_element',)
 
-        element =  HTMLElement(self)
-        html = element.render(self.render_children(), indentation=indentation)
+    def __init__(self, *args, **kwargs):
+        Node.__init__(self, *args, **kwargs)
 
-        if element.outerstrip:
-            raise StripOuter(html)
-        else:
-            return html
+        self._element = None
+
+    @property
+    def element(self):
+        if self._element is None:
+            if self.parser.hooks is None:
+                self._element = HTMLElement(self)
+            else:
+                self._element = instrument.timed_element(HTMLElement, self, self.parser.hooks)
+
+        return self._element
+
+    @property
+    def outerstrip(self):
+        return parse_line(self.haml).outerstrip
+
+    @property
+    def static(self):
+        return parse_line(self.haml).static
+
+    @property
+    def block(self):
+        return parse_line(self.haml).tag in BLOCK
+
+    @property
+    def preserve(self):
+        return parse_line(self.haml).tag in PRESERVE
 
+    def iter_html(self, lstrip=False):
+        if self.compact:
+            if self.preserve:
+                # The content is kept as is, and with it the indentation of
+                # the closing tag.
+                return self.element.iter_render(self.iter_children(), indentation=self.indentation, lstrip=True)
+
+            return self.element.iter_render(self.iter_children(), compact=True)
+
+        return self.element.iter_render(self.iter_children(), indentation=self.indentation, lstrip=lstrip)
+
+    def iter_stripped(self, lstrip, rstrip):
+        # Elements only start with their indentation and end with a tag.
+        return self.iter_html(lstrip)
+
+@register('/')
 class HTMLCommentNode(Node):
-    def to_html(self):
+    __slots__ = ()
+
+    @property
+    def static(self):
+        return utils.split_interpolation(self.haml) is None
+
+    def iter_html(self):
         conditionals = re.findall(r'^/\[(.*?)\]', self.haml)
 
         if conditionals:
@@ -222,27 +383,56 @@ class HTMLCommentNode(Node):
             start = '<!--'
             end = '-->'
 
-        rendered_children = self.render_children()
+        start = utils.interpolate(start, self.parser.target)
+        first, children = utils.peek_chunks(self.iter_children())
+
+        if first is None:
+            comment = utils.interpolate(self.haml.lstrip(OPERATORS['html-comment']).lstrip(), self.parser.target)
+            yield self._indent(' '.join([start, comment, end]))
+            return
 
-        if rendered_children:
-            return '\n'.join([self._indent(start), rendered_children, self._indent(end)])
+        yield self._indent(start)
+        yield _NEWLINE
 
-        return self._indent(' '.join([start, self.haml.lstrip(OPERATORS['html-comment']).lstrip(), end]))
+        for chunk in children:
+            yield chunk
 
+        yield _NEWLINE
+        yield self._indent(end)
+
+@register('-#')
 class HAMLComment(Node):
-    def to_html(self):
-        return None
+    __slots__ = ()
+
+    # The body of a comment is never parsed.
+    PARSE = False
+    RENDER = False
 
+    def extend(self, source, lineno):
+        pass
+
+    @property
+    def static(self):
+        return True
+
+    def iter_html(self):
+        return iter(())
+
+@register('=', '>=')
 class EvalNode(Node):
-    def to_html(self):
-        content = self._indent(self.parser.target.eval(self.haml.lstrip(OPERATORS['outerstrip']).lstrip(OPERATORS['evaluate']).strip()))
+    __slots__ = ()
 
-        if self.haml.startswith(OPERATORS['outerstrip']):
-            raise StripOuter(content)
+    @property
+    def outerstrip(self):
+        return self.haml.startswith(OPERATORS['outerstrip'])
 
-        return content
+    def iter_html(self):
+        yield self._indent(self.parser.target.eval(self.haml.lstrip(OPERATORS['outerstrip']).lstrip(OPERATORS['evaluate']).strip()))
 
+@register('-')
 class CodeNode(Node):
+    __slots__ = ('keyword', 'expression')
+
     def __init__(self, *args, **kwargs):
         Node.__init__(self, *args, **kwargs)
 
@@ -254,60 +444,157 @@ class CodeNode(Node):
         if len(parts) > 1:
             self.expression = parts[1]
 
-    def to_html(self):
+    def iter_html(self):
         open, close = self.parser.target.block(self, self.keyword, self.expression)
 
-        return ''.join(map(str.strip, (open, self.render_children(), close)))
+        yield open.strip()
 
-class PlainFilterNode(Node):
-    PARSE = False
+        for chunk in utils.strip_chunks(self.iter_children()):
+            yield chunk
 
-    def to_html(self):
-        return '\n'.join([line[INDENT:] for line in self.nested_haml])
+        yield close.strip()
 
-class EscapedFilterNode(PlainFilterNode):
-    PARSE = False
+    def iter_stripped(self, lstrip, rstrip):
+        # Both ends are already stripped.
+        return self.iter_html()
 
-    def to_html(self):
-        return utils.xhtml_escape(PlainFilterNode.to_html(self))
+@register('+')
+class IncludeNode(Node):
+    """Renders another template in place, as if its lines were nested here.
 
-class CdataFilterNode(Node):
-    PARSE = False
+    Templates are looked up by name through the parser's ``loader``, which
+    also keeps their compiled form and tracks which templates include which.
+    """
 
-    def to_html(self):
-        buf = [self._indent('//<![CDATA[', self.indentation)]
+    __slots__ = ('name',)
 
-        for line in self.nested_haml:
-            buf.append(line[INDENT:])
+    def __init__(self, *args, **kwargs):
+        Node.__init__(self, *args, **kwargs)
 
-        buf.append(self._indent('//]]>', self.indentation))
+        self.name = self.haml[len(OPERATORS['include']):].strip()
 
-        return '\n'.join(buf)
+    def iter_html(self):
+        loader = self.parser.loader
 
-class JavaScriptFilterNode(Node):
-    PARSE = False
+        if loader is None:
+            raise ValueError('cannot include %r without a loader' % self.name)
 
-    def to_html(self):
-        buf = [self._indent('<script type="text/javascript">'), self._indent('//<![CDATA[', self.indentation + 1)]
+        html = loader.include(self.name, self.parser, self.indentation, self.compact)
 
-        for line in self.nested_haml:
-            buf.append(line[INDENT:])
+        if html.endswith(_NEWLINE):
+            html = html[:-1]
 
-        buf.append(self._indent('//]]>', self.indentation + 1))
-        buf.append(self._indent('</script>'))
+        yield html
 
-        return '\n'.join(buf)
+class FilterNode(Node):
+    __slots__ = ('source', 'span')
 
-class CssFilterNode(Node):
     PARSE = False
+    INTERPOLATE = True
 
-    def to_html(self):
-        buf = [self._indent('<style type="text/css">'), self._indent('//<![CDATA[', self.indentation + 1)]
+    def __init__(self, *args, **kwargs):
+        Node.__init__(self, *args, **kwargs)
+
+        self.source = None
+        self.span = None
+
+    def extend(self, source, lineno):
+        """Grows the filter body to include source line ``lineno``."""
+
+        self.source = source
+        self.span = (self.span[0] if self.span else lineno - 1, lineno)
+
+    @property
+    def static(self):
+        return not self.INTERPOLATE or not any(utils.split_interpolation(line) for line in self.nested_haml)
+
+    @property
+    def nested_haml(self):
+        if self.span is None:
+            return []
+
+        return self.source.get_lines(*self.span)
+
+    def _iter_lines(self):
+        for i, line in enumerate(self.nested_haml):
+            if i:
+                yield _NEWLINE
+
+            if self.INTERPOLATE:
+                yield utils.interpolate(line[INDENT:], self.parser.target)
+            else:
+                yield line[INDENT:]
+
+    def _iter_body(self):
+        # The lines on lines of their own, or nothing without nested lines.
+        if self.span is None:
+            return
+
+        for chunk in self._iter_lines():
+            yield chunk
+
+        yield _NEWLINE
+
+@register(':plain')
+class PlainFilterNode(FilterNode):
+    __slots__ = ()
+
+    INTERPOLATE = False
+
+    def iter_html(self):
+        return self._iter_lines()
+
+@register(':escaped')
+class EscapedFilterNode(PlainFilterNode):
+    __slots__ = ()
+
+    def iter_html(self):
+        for chunk in self._iter_lines():
+            yield utils.xhtml_escape(chunk)
+
+@register(':cdata')
+class CdataFilterNode(FilterNode):
+    __slots__ = ()
+
+    def iter_html(self):
+        yield self._indent('//<![CDATA[', self.indentation)
+        yield _NEWLINE
+
+        for chunk in self._iter_body():
+            yield chunk
+
+        yield self._indent('//]]>', self.indentation)
+
+@register(':javascript')
+class JavaScriptFilterNode(FilterNode):
+    __slots__ = ()
+
+    def iter_html(self):
+        yield self._indent('<script type="text/javascript">')
+        yield _NEWLINE
+        yield self._indent('//<![CDATA[', self.indentation + 1)
+        yield _NEWLINE
+
+        for chunk in self._iter_body():
+            yield chunk
+
+        yield self._indent('//]]>', self.indentation + 1)
+        yield _NEWLINE
+        yield self._indent('</script>')
+
+@register(':css')
+class CssFilterNode(FilterNode):
+    __slots__ = ()
 
-        for line in self.nested_haml:
-            buf.append(line[INDENT:])
+    def iter_html(self):
+        yield self._indent('<style type="text/css">')
+        yield _NEWLINE
+        yield self._indent('//<![CDATA[', self.indentation + 1)
+        yield _NEWLINE
 
-        buf.append(self._indent('//]]>', self.indentation + 1))
-        buf.append(self._indent('</style>'))
+        for chunk in self._iter_body():
+            yield chunk
 
-        return '\n'.join(buf)
\ No newline at end of file
+        yield self._indent('//]]>', self.indentation + 1)
+        yield _NEWLINE
+        yield self._indent('</style>')
@@ -0,0 +1,112 @@
+"""Compiles very large templates on several processes.
+
+``render`` splits a template into chunks of top-level blocks, has a process
+pool compile every chunk into the IR (see ``haiku.ir``), which is where the
+parsing and nearly all of the rendering happen, and renders the IR of all
+chunks in order with a single target instance. The output is the same as
+rendering the template in one piece: code blocks, the loop counters of the
+``Underscore`` target included, are only rendered in the final pass.
+
+Chunks are only split between two top-level elements when nothing crosses
+the boundary: neither element strips whitespace with ``>``, neither line
+continues a multiline ``|`` line, and so no ``- if``/``- else`` chain, whose
+closing depends on the next sibling, is ever cut. In compact output the
+newline between two block elements is left out, as it would be.
+"""
+
+from .constants import OPERATORS
+from .element import BLOCK, parse_line
+from .haml import HAML
+from .target import Default
+from . import ir
+import multiprocessing
+
+_ELEMENT = (OPERATORS['element'], OPERATORS['id'], OPERATORS['class'])
+_MULTILINE = OPERATORS['multiline']
+
+def _boundary(line):
+    """Returns the parsed element line if a chunk can start or end with the
+    top-level ``line``, otherwise ``None``."""
+
+    line = line.rstrip()
+
+    if not line.startswith(_ELEMENT) or line.endswith(_MULTILINE):
+        return None
+
+    element = parse_line(line)
+
+    return None if element.outerstrip else element
+
+def split(haml, size):
+    """Splits ``haml`` into ``(chunk, joined)`` pairs of roughly ``size`` lines
+    each, where ``joined`` says whether the output of the chunk follows the
+    output of the previous one without a separating newline in compact
+    output."""
+
+    lines = haml.split('\n')
+    chunks = []
+    start = 0
+    previous = None
+
+    for i, line in enumerate(lines):
+        if not line or line[0] in ' \t':
+            continue
+
+        element = _boundary(line)
+
+        if element is not None and previous is not None and i - start >= size:
+            joined = previous.tag in BLOCK and element.tag in BLOCK
+            chunks.append(('\n'.join(lines[start:i]), joined))
+            start = i
+
+        previous = element
+
+    chunks.append(('\n'.join(lines[start:]), False))
+
+    # Each chunk records whether it is joined to the one before it.
+    return [(chunk, i > 0 and chunks[i - 1][1]) for i, (chunk, _) in enumerate(chunks)]
+
+def _compile(args):
+    haml, compact = args
+    return ir.compile(haml, compact)
+
+def render(haml, target=Default, compact=False, processes=None, size=None, pool=None):
+    """Renders ``haml`` with ``target`` on ``pool``, or on a pool of
+    ``processes`` processes started for the call. Chunks are about ``size``
+    lines long, by default enough for four chunks per process. Templates
+    that cannot be split are rendered in the calling process. Includes are
+    not supported."""
+
+    processes = processes or multiprocessing.cpu_count()
+
+    if size is None:
+        size = max(1, haml.count('\n') // (processes * 4))
+
+    # The IR reserves NUL for its markers.
+    chunks = split(haml, size) if '\x00' not in haml else []
+
+    if len(chunks) < 2:
+        return HAML(haml, target=target, compact=compact).render()
+
+    own = pool is None
+
+    if own:
+        pool = multiprocessing.Pool(processes)
+
+    try:
+        compiled = pool.map(_compile, [(chunk, compact) for chunk, _ in chunks])
+    finally:
+        if own:
+            pool.close()
+            pool.join()
+
+    instructions = []
+
+    for (_, joined), chunk in zip(chunks, compiled):
+        # The output of every chunk ends with its closing tag and a newline.
+        if joined and compact:
+            instructions[-1] = instructions[-1][:-1]
+
+        instructions.extend(chunk)
+
+    return ir.render(instructions, target)
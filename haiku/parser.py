@@ -0,0 +1,280 @@
+from .constants import OPERATORS
+from .node import Node
+from . import instrument, utils
+import array
+import hashlib
+import mmap
+import os
+
+_MULTILINE = OPERATORS['multiline']
+
+# Output of the static subtrees folded so far, shared by every template in the
+# process. Cleared when it grows too large.
+_FRAGMENTS = {}
+_FRAGMENTS_SIZE = 10000
+
+class Source(object):
+    """The lines of a template, shared by every node parsed from it."""
+
+    __slots__ = ('lines',)
+
+    def __init__(self, haml):
+        self.lines = haml.split('\n')
+
+    def get_lines(self, start, end):
+        return [line for line in self.lines[start:end] if line]
+
+class MappedSource(Source):
+    """The lines of a template file, memory-mapped instead of read.
+
+    The file is hashed a block at a time and only the offsets of its lines are
+    kept; a line is copied out of the map when it is parsed or output.
+    """
+
+    __slots__ = ('sha1', '_buffer')
+
+    BLOCK = 1 << 20
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            self._buffer = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) if size else ''
+
+        sha1 = hashlib.sha1()
+
+        for offset in range(0, size, self.BLOCK):
+            sha1.update(self._buffer[offset:offset + self.BLOCK])
+
+        self.sha1 = sha1.hexdigest()
+        self.lines = _MappedLines(self._buffer)
+
+class _MappedLines(object):
+    """A read-only list of the lines in a buffer, as ``split('\\n')`` returns."""
+
+    __slots__ = ('buffer', 'offsets')
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+
+        # The start of every line, and one past the end of the buffer.
+        self.offsets = offsets = array.array('l', [0])
+        find = buffer.find
+        position = find('\n')
+
+        while position != -1:
+            offsets.append(position + 1)
+            position = find('\n', position + 1)
+
+        offsets.append(len(buffer) + 1)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in xrange(*index.indices(len(self)))]
+
+        if index < 0:
+            index += len(self)
+
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+
+        return self.buffer[self.offsets[index]:self.offsets[index + 1] - 1]
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+def tokenize(source):
+    """Yields a ``(lineno, indentation, line)`` token for every non-empty source line."""
+
+    for lineno, line in enumerate(source.lines, 1):
+        if line:
+            yield lineno, utils.indentation(line), line
+
+def parse(parser, haml, indentation=0, stats=None):
+    """Parses ``haml``, a string or a ``Source``, into a tree of nodes and
+    returns its root. The top level nodes are at ``indentation``. ``stats``
+    is filled as by ``build``."""
+
+    source = haml if isinstance(haml, Source) else Source(haml)
+    root = Node(parser, '', indentation=indentation - 1)
+    build(root, tokenize(source), source, stats=stats)
+    return root
+
+def build(root, tokens, source, blocks=None, stats=None):
+    """Builds the tree under ``root`` from a token stream in a single pass.
+
+    Every open block is kept on a stack together with the indentation of the
+    line that opened it, so a token only has to be compared against the top of
+    the stack to find its parent.
+
+    ``blocks`` can supply already built subtrees: ``blocks.lookup(parent,
+    lineno)`` returns a ``(node, last lineno)`` pair for the block starting at
+    ``lineno`` or ``None``, and ``blocks.created(node, lineno)`` is told about
+    every node built instead.
+
+    The lines nested in a node that is not rendered, such as a HAML comment,
+    are skipped without being parsed. A ``stats`` dict gets the number of
+    ``nodes`` built and of ``skipped`` lines.
+    """
+
+    stack = [(root, -1)]
+    parents = [root]
+    skipped = 0
+    tokens = _Lookahead(tokens)
+    create = Node.create
+    hooks = getattr(root.parser, 'hooks', None)
+
+    if hooks is not None:
+        create = instrument.timed_create(create, hooks)
+
+    for lineno, line_indentation, line in tokens:
+        while stack[-1][1] >= line_indentation:
+            stack.pop()
+
+        parent, parent_indentation = stack[-1]
+
+        if not parent.PARSE:
+            parent.extend(source, lineno)
+
+            if not parent.RENDER:
+                skipped += 1
+
+            continue
+
+        if blocks is not None:
+            block = blocks.lookup(parent, lineno)
+
+            if block is not None:
+                node, last = block
+                node.parent = parent
+                parent.add_child(node)
+
+                while tokens.peek() is not None and tokens.peek()[0] <= last:
+                    next(tokens)
+
+                continue
+
+        line = line.rstrip()
+
+        if line.endswith(_MULTILINE):
+            line = _join_multiline(line, tokens, parent_indentation)
+
+        node = create(parent.parser, line, parent=parent, indentation=parent.indentation + 1)
+        parent.add_child(node)
+        stack.append((node, line_indentation))
+        parents.append(node)
+
+        if blocks is not None:
+            blocks.created(node, lineno)
+
+    if stats is not None:
+        stats['nodes'] = len(parents) - 1
+        stats['skipped'] = skipped
+
+    # Grafted blocks keep what was resolved for their own children. Trees
+    # parsed without a parser are never rendered.
+    if root.parser is not None:
+        for node in parents:
+            if node.children:
+                node.resolve_whitespace()
+
+    return root
+
+def fold(root):
+    """Renders every largest subtree of static nodes under ``root`` once and
+    stores its output on the subtree's top node, which is then rendered from
+    it. Identical subtrees share one string across templates."""
+
+    # Children come after their parents in ``nodes``, so walking it backwards
+    # settles every child before its parent.
+    nodes = []
+    stack = list(root.children)
+
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        stack.extend(node.children)
+
+    static = set()
+
+    for node in reversed(nodes):
+        if node.static and all(child in static for child in node.children):
+            static.add(node)
+
+    stack = list(root.children)
+
+    while stack:
+        node = stack.pop()
+
+        if node not in static:
+            stack.extend(node.children)
+        elif node.RENDER:
+            node.fragment = _intern(node)
+
+    return root
+
+def _intern(node):
+    # Output of a static subtree only depends on its lines, its indentation
+    # and whether it is compact.
+    key = [node.compact]
+    stack = [node]
+
+    while stack:
+        node_ = stack.pop()
+        key.append((node_.indentation, node_.haml, len(node_.children)))
+
+        if not node_.PARSE and node_.RENDER:
+            key.append(tuple(node_.nested_haml))
+
+        stack.extend(node_.children)
+
+    key = tuple(key)
+    fragment = _FRAGMENTS.get(key)
+
+    if fragment is None:
+        if len(_FRAGMENTS) >= _FRAGMENTS_SIZE:
+            _FRAGMENTS.clear()
+
+        fragment = _FRAGMENTS[key] = ''.join(node.iter_html())
+
+    return fragment
+
+def _join_multiline(line, tokens, parent_indentation):
+    m_lines = [line]
+
+    while True:
+        token = tokens.peek()
+
+        # Continuation lines can not escape the block they started in.
+        if token is None or token[1] <= parent_indentation or not token[2].endswith(_MULTILINE):
+            break
+
+        m_lines.append(next(tokens)[2].rstrip())
+
+    return ' '.join(line.rstrip(_MULTILINE).strip() for line in m_lines)
+
+class _Lookahead(object):
+    def __init__(self, iterable):
+        self._iterator = iter(iterable)
+        self._peeked = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._peeked is not None:
+            token, self._peeked = self._peeked, None
+            return token
+
+        return next(self._iterator)
+
+    next = __next__
+
+    def peek(self):
+        if self._peeked is None:
+            self._peeked = next(self._iterator, None)
+
+        return self._peeked
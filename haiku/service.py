@@ -0,0 +1,237 @@
+"""Compiles templates from many threads at once.
+
+A ``CompileService`` can be shared by every thread of a process. Each compile
+gets its own ``HAML`` and so its own target instance and render state (the
+loop counters of ``Underscore``, for one); the only state compiles share is
+the cache, which locks every operation, and the line and fragment memos of
+the parser, which are only ever read and filled a key at a time.
+
+Concurrent requests for the same template are compiled once: the first one
+compiles it while the others wait for its result instead of compiling it
+again. ``compile_many`` compiles a list of templates on an executor.
+
+With Tornado, ``compile_async`` and ``compile_many_async`` compile on an
+executor without blocking the ``IOLoop``, and the module level functions of
+the same names do so through a service shared by the whole process.
+"""
+
+from .cache import Cache
+from .haml import HAML, _CACHE
+from .target import Default
+import datetime
+import threading
+
+try:
+    import tornado.concurrent
+    import tornado.gen
+    import tornado.ioloop
+except ImportError:
+    tornado = None
+
+class _Flight(object):
+    """A compile in progress that other threads can wait for."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.html = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+
+        if self.error is not None:
+            raise self.error
+
+        return self.html
+
+class CompileService(object):
+    """Compiles templates for ``target`` into ``cache``, from any thread.
+
+    ``compile_many`` runs on ``executor``, any object with a ``map(function,
+    iterable)`` method returning the results in order that runs the function
+    on threads of this process, such as a ``concurrent.futures`` thread pool;
+    the function compiles through the service, so it cannot be sent to other
+    processes. By default a thread pool of ``workers`` threads is started the
+    first time it is needed; ``close`` stops it.
+
+    ``compile_async`` runs on ``executor`` too, which must then be a
+    ``concurrent.futures`` executor; a process pool works, as only the
+    template and its options are sent to it. By default the ``IOLoop``'s
+    executor is used.
+    """
+
+    def __init__(self, target=Default, compact=False, cache=None, executor=None, workers=4):
+        self.target = target
+        self.compact = compact
+        self.cache = Cache() if cache is None else cache
+        self.executor = executor
+        self.workers = workers
+
+        self._lock = threading.Lock()
+        self._pool = None
+
+        # cache key -> _Flight of the compile in progress
+        self._flights = {}
+
+        # (IOLoop, cache key) -> future of the compile in progress, only used
+        # from the thread running the loop
+        self._futures = {}
+
+    def _template(self, haml, target, compact):
+        return HAML(haml,
+                    target=self.target if target is None else target,
+                    cache=self.cache,
+                    compact=self.compact if compact is None else compact)
+
+    def compile(self, haml, target=None, compact=None):
+        """Returns the output of ``haml``. The service's ``target`` and
+        ``compact`` are used unless given."""
+
+        template = self._template(haml, target, compact)
+        key = template.cache_key
+
+        html = self.cache.get(key)
+
+        if html is not None:
+            return html
+
+        with self._lock:
+            flight = self._flights.get(key)
+
+            if flight is not None:
+                leader = False
+            else:
+                # A compile may have landed since the cache was looked at.
+                html = self.cache.get(key)
+
+                if html is not None:
+                    return html
+
+                leader = True
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            return flight.wait()
+
+        try:
+            flight.html = template.render()
+            self.cache.set(key, flight.html)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+
+            flight.done.set()
+
+        return flight.html
+
+    def compile_many(self, templates, target=None, compact=None):
+        """Compiles every template of ``templates`` on the executor's threads
+        and returns their output in the same order."""
+
+        executor = self.executor
+
+        if executor is None:
+            from multiprocessing.pool import ThreadPool
+
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPool(self.workers)
+
+            executor = self._pool
+
+        return list(executor.map(lambda haml: self.compile(haml, target, compact), templates))
+
+    def compile_async(self, haml, target=None, compact=None, timeout=None):
+        """Returns a Tornado future of the output of ``haml``, compiled on the
+        executor while the current ``IOLoop`` goes on; coroutines yield it.
+
+        Concurrent calls for the same template share one compile. With
+        ``timeout`` the future fails with ``tornado.util.TimeoutError`` after
+        that many seconds; timing out never cancels the shared compile, which
+        still fills the cache for the other callers.
+        """
+
+        if tornado is None:
+            raise RuntimeError('compile_async needs tornado')
+
+        io_loop = tornado.ioloop.IOLoop.current()
+        template = self._template(haml, target, compact)
+        key = template.cache_key
+        html = self.cache.get(key)
+
+        if html is not None:
+            future = tornado.concurrent.Future()
+            future.set_result(html)
+            return future
+
+        flight = self._futures.get((io_loop, key))
+
+        if flight is None:
+            flight = self._futures[io_loop, key] = io_loop.run_in_executor(
+                self.executor, _render, haml, type(template.target), bool(template.options.get('compact')))
+            tornado.concurrent.future_add_done_callback(flight, lambda flight: self._landed(io_loop, key, flight))
+
+        if timeout is not None:
+            # Errors after the timeout reach the other callers, if any.
+            return tornado.gen.with_timeout(datetime.timedelta(seconds=timeout), flight, quiet_exceptions=Exception)
+
+        # Every caller gets a future of its own, so none can affect the others.
+        future = tornado.concurrent.Future()
+        tornado.concurrent.chain_future(flight, future)
+
+        return future
+
+    def _landed(self, io_loop, key, flight):
+        del self._futures[io_loop, key]
+
+        if flight.exception() is None:
+            self.cache.set(key, flight.result())
+
+    def compile_many_async(self, templates, target=None, compact=None, timeout=None):
+        """Returns a Tornado future of the output of every template of
+        ``templates``, in the same order; see ``compile_async``."""
+
+        if tornado is None:
+            raise RuntimeError('compile_many_async needs tornado')
+
+        return tornado.gen.multi([self.compile_async(haml, target, compact, timeout) for haml in templates])
+
+    def close(self):
+        """Stops the thread pool started by ``compile_many``, if any."""
+
+        with self._lock:
+            pool, self._pool = self._pool, None
+
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+def _render(haml, target, compact):
+    # Runs on the executor, possibly in another process.
+    return HAML(haml, target=target, cache=Cache(), compact=compact).render()
+
+_SERVICE = None
+_SERVICE_LOCK = threading.Lock()
+
+def _service():
+    global _SERVICE
+
+    with _SERVICE_LOCK:
+        if _SERVICE is None:
+            _SERVICE = CompileService(cache=_CACHE)
+
+    return _SERVICE
+
+def compile_async(haml, target=Default, compact=False, timeout=None):
+    """``CompileService.compile_async`` on a service shared by the process,
+    caching into the same cache as ``HAML``."""
+
+    return _service().compile_async(haml, target, compact, timeout)
+
+def compile_many_async(templates, target=Default, compact=False, timeout=None):
+    """``CompileService.compile_many_async`` on the service shared by the process."""
+
+    return _service().compile_many_async(templates, target, compact, timeout)
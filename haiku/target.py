@@ -1,4 +1,3 @@
-from .node import CodeNode
 import re
 
 class Default(object):
@@ -23,12 +22,13 @@ class Default(object):
 
         close = ''
 
-        sibling = node.get_sibling(1)
+        # Only code blocks have a keyword.
+        sibling = getattr(node.get_sibling(1), 'keyword', None)
 
         try:
             continuation = self.RULES[keyword].get('continuation')
 
-            if not (isinstance(sibling, CodeNode) and continuation and sibling.keyword in continuation):
+            if not (continuation and sibling in continuation):
                 close = self.CONTROL % self.RULES[keyword]['close']
         except KeyError:
             pass
@@ -1,12 +1,18 @@
 from .constants import INDENT
+import itertools
 import re
 
+# Indent prefixes for the nesting depths seen in practice.
+_INDENTS = [' ' * (i * INDENT) for i in xrange(32)]
+
 def indent(line, indentation):
     if not indentation or not line:
         return line
 
-    spaces = ''.join([' ' for _ in xrange(indentation * INDENT)])
-    return spaces + line
+    if indentation < len(_INDENTS):
+        return _INDENTS[indentation] + line
+
+    return ' ' * (indentation * INDENT) + line
 
 def indentation(haml):
     return len(haml) - len(haml.lstrip())
@@ -21,4 +27,94 @@ def xhtml_escape(value):
     elif not isinstance(value, unicode):
         value = str(value)
 
-    return _XHTML_ESCAPE_RE.sub(lambda match: _XHTML_ESCAPE_DICT[match.group(0)], value)
\ No newline at end of file
+    return _XHTML_ESCAPE_RE.sub(lambda match: _XHTML_ESCAPE_DICT[match.group(0)], value)
+
+# Helpers for streams of rendered chunks. Only whitespace is ever held back,
+# so none of them buffer more than the whitespace between two pieces of output.
+
+def lstrip_chunks(chunks):
+    chunks = iter(chunks)
+
+    for chunk in chunks:
+        chunk = chunk.lstrip()
+
+        if chunk:
+            yield chunk
+            break
+
+    for chunk in chunks:
+        yield chunk
+
+def rstrip_chunks(chunks):
+    whitespace = []
+
+    for chunk in chunks:
+        stripped = chunk.rstrip()
+
+        if stripped:
+            for pending in whitespace:
+                yield pending
+
+            yield stripped
+            whitespace = [chunk[len(stripped):]]
+        else:
+            whitespace.append(chunk)
+
+def strip_chunks(chunks):
+    return rstrip_chunks(lstrip_chunks(chunks))
+
+def peek_chunks(chunks):
+    """Returns ``(first, chunks)`` where ``first`` is the first non-empty chunk
+    (or ``None``) and ``chunks`` still yields every non-empty chunk."""
+
+    chunks = iter(chunks)
+
+    for chunk in chunks:
+        if chunk:
+            return chunk, itertools.chain((chunk,), chunks)
+
+    return None, iter(())
+
+# "#{expression}" interpolation. Text is split once into alternating literal
+# text and expressions, which are handed to the target's eval when rendered.
+
+def split_interpolation(text):
+    """Returns ``[text, expression, text, ...]`` for ``text``, or ``None``
+    when it contains nothing to interpolate."""
+
+    start = text.find('#{')
+
+    if start == -1:
+        return None
+
+    parts = []
+    position = 0
+
+    while start != -1:
+        end = text.find('}', start + 2)
+
+        if end == -1:
+            break
+
+        if text.find('\n', start + 2, end) != -1:
+            start = text.find('#{', start + 1)
+            continue
+
+        parts.append(text[position:start])
+        parts.append(text[start + 2:end])
+        position = end + 1
+        start = text.find('#{', position)
+
+    if not parts:
+        return None
+
+    parts.append(text[position:])
+
+    return parts
+
+def join_interpolation(parts, target):
+    return ''.join(target.eval(part) if i % 2 else part for i, part in enumerate(parts))
+
+def interpolate(text, target):
+    parts = split_interpolation(text)
+    return text if parts is None else join_interpolation(parts, target)
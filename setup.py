@@ -29,4 +29,9 @@ setup(name='haiku',
     platforms=['any'],
     classifiers=CLASSIFIERS,
     test_suite='tests',
+    entry_points={
+        'console_scripts': [
+            'haiku = haiku.cli:main',
+        ],
+    },
 )
\ No newline at end of file
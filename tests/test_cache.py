@@ -0,0 +1,127 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from haiku import HAML, Tornado, Underscore
+from haiku.cache import Cache, DiskCache
+
+class CacheTest(unittest.TestCase):
+    def test_cache_is_target_aware(self):
+        cache = Cache()
+        haml = '- if a\n  %p= b'
+        self.assertEqual('{%if a%}<p>{{b}}</p>{%end%}\n', HAML(haml, target=Tornado, cache=cache).to_html())
+        self.assertEqual('<%if (a) {%><p><%=b%></p><%}%>\n', HAML(haml, target=Underscore, cache=cache).to_html())
+        self.assertEqual(2, len(cache))
+
+    def test_hit_skips_parsing(self):
+        cache = Cache()
+        HAML('%p', target=Tornado, cache=cache).to_html()
+        haml = HAML('%p', target=Tornado, cache=cache)
+        self.assertEqual('<p></p>\n', haml.to_html())
+        self.assertIsNone(haml._node)
+        self.assertEqual({'entries': 1, 'bytes': 8, 'hits': 1, 'misses': 1, 'evictions': 0}, cache.stats())
+
+    def test_lru_eviction(self):
+        cache = Cache(max_entries=2)
+        cache.set(('a',), 'A')
+        cache.set(('b',), 'B')
+        cache.get(('a',))
+        cache.set(('c',), 'C')
+        self.assertIn(('a',), cache)
+        self.assertNotIn(('b',), cache)
+        self.assertEqual(1, cache.evictions)
+
+    def test_byte_limit(self):
+        cache = Cache(max_bytes=5)
+        cache.set(('a',), 'aaa')
+        cache.set(('b',), 'bbb')
+        self.assertEqual(['b'], [key[0] for key in cache._entries])
+        cache.set(('c',), 'cccccc')
+        self.assertNotIn(('c',), cache)
+        self.assertEqual(3, cache.stats()['bytes'])
+
+    def test_invalidate(self):
+        cache = Cache()
+        haml = HAML('%p', target=Tornado, cache=cache)
+        haml.to_html()
+        HAML('%p', target=Underscore, cache=cache).to_html()
+        HAML('%q', target=Tornado, cache=cache).to_html()
+        cache.invalidate(haml.sha1)
+        self.assertEqual(1, len(cache))
+        cache.clear()
+        self.assertEqual(0, len(cache))
+
+class DiskCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_shared_between_instances(self):
+        HAML('%p= a', target=Tornado, cache=DiskCache(self.directory)).to_html()
+
+        cache = DiskCache(self.directory)
+        haml = HAML('%p= a', target=Tornado, cache=cache)
+        self.assertEqual('<p>{{a}}</p>\n', haml.to_html())
+        self.assertIsNone(haml._node)
+        self.assertEqual(1, cache.hits)
+
+    def test_keyed_by_target(self):
+        cache = DiskCache(self.directory)
+        key = HAML('%p', target=Tornado).cache_key
+        self.assertNotEqual(cache.path(key), cache.path(HAML('%p', target=Underscore).cache_key))
+        self.assertIsNone(cache.get(key))
+        cache.set(key, u'<p>\u2603</p>')
+        self.assertEqual('<p>\xe2\x98\x83</p>', cache.get(key))
+        self.assertIsInstance(cache.get(key), str)
+        cache.set(key, '')
+        self.assertEqual('', cache.get(key))
+
+    def test_invalidate(self):
+        memory = Cache()
+        cache = DiskCache(self.directory, memory=memory)
+        cache.set(('a', Tornado, ()), 'A')
+        cache.set(('a', Underscore, ()), 'A')
+        cache.set(('b', Tornado, ()), 'B')
+        cache.invalidate('a')
+        self.assertIsNone(cache.get(('a', Tornado, ())))
+        self.assertIsNone(cache.get(('a', Underscore, ())))
+        self.assertEqual('B', DiskCache(self.directory).get(('b', Tornado, ())))
+        cache.invalidate('c')
+
+    def test_temporary_files_are_not_entries(self):
+        cache = DiskCache(self.directory)
+        cache.set(('a', Tornado, ()), 'A')
+        temporary = os.path.join(os.path.dirname(cache.path(('a', Tornado, ()))), '.tmpwriting')
+
+        with open(temporary, 'w') as f:
+            f.write('partial')
+
+        self.assertEqual(1, cache.stats()['entries'])
+        self.assertEqual(1, cache.prune(0))
+        cache.clear()
+        self.assertTrue(os.path.exists(temporary))
+
+    def test_memory_front(self):
+        memory = Cache()
+        cache = DiskCache(self.directory, memory=memory)
+        cache.set(('a', Tornado, ()), 'A')
+        os.unlink(cache.path(('a', Tornado, ())))
+        self.assertEqual('A', cache.get(('a', Tornado, ())))
+
+    def test_prune(self):
+        cache = DiskCache(self.directory)
+
+        for i, name in enumerate('abc'):
+            key = (name, Tornado, ())
+            cache.set(key, name * 10)
+            os.utime(cache.path(key), (time.time() - 100 + i, time.time() - 100 + i))
+
+        self.assertEqual(2, cache.prune(15))
+        self.assertEqual('c' * 10, cache.get(('c', Tornado, ())))
+        self.assertEqual({'entries': 1, 'bytes': 10, 'hits': 1, 'misses': 0}, cache.stats())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+from haiku.cli import Watcher, compile_tree
+
+class TreeTest(unittest.TestCase):
+    def setUp(self):
+        self.source = tempfile.mkdtemp()
+        self.output = tempfile.mkdtemp()
+
+        self._write('index.haml', '%p= name')
+        self._write('partials/nav.haml', '%ul\n  %li a')
+
+    def tearDown(self):
+        shutil.rmtree(self.source)
+        shutil.rmtree(self.output)
+
+    def _write(self, name, haml):
+        path = os.path.join(self.source, name)
+
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        with open(path, 'w') as f:
+            f.write(haml)
+
+    def _read(self, name):
+        with open(os.path.join(self.output, name)) as f:
+            return f.read()
+
+class CompileTreeTest(TreeTest):
+    def test_compiles_tree(self):
+        self.assertEqual(0, compile_tree(self.source, self.output, 'Underscore', jobs=2, out=StringIO()))
+        self.assertEqual('<p><%=name%></p>\n', self._read('index.html'))
+        self.assertEqual('<ul>\n  <li>a</li>\n</ul>\n', self._read('partials/nav.html'))
+
+    def test_skips_unchanged_files(self):
+        compile_tree(self.source, self.output, jobs=1, out=StringIO())
+        self._write('index.haml', '%p changed')
+
+        out = StringIO()
+        compile_tree(self.source, self.output, jobs=1, out=out)
+        self.assertIn('index.haml', out.getvalue())
+        self.assertNotIn('nav.haml', out.getvalue())
+        self.assertIn('compiled 1, skipped 1, failed 0', out.getvalue())
+        self.assertEqual('<p>changed</p>\n', self._read('index.html'))
+
+        out = StringIO()
+        compile_tree(self.source, self.output, 'Underscore', jobs=1, out=out)
+        self.assertIn('compiled 2, skipped 0', out.getvalue())
+
+    def test_recompiles_includers(self):
+        self._write('page.haml', '%div\n  + partials/nav')
+        compile_tree(self.source, self.output, jobs=1, out=StringIO())
+        self.assertEqual('<div>\n  <ul>\n    <li>a</li>\n  </ul>\n</div>\n', self._read('page.html'))
+
+        self._write('partials/nav.haml', '%ul\n  %li b')
+        out = StringIO()
+        compile_tree(self.source, self.output, jobs=1, out=out)
+        self.assertIn('compiled 2, skipped 1', out.getvalue())
+        self.assertEqual('<div>\n  <ul>\n    <li>b</li>\n  </ul>\n</div>\n', self._read('page.html'))
+
+    def test_reports_failures(self):
+        self._write('broken.haml', '%p{broken}')
+        out = StringIO()
+        self.assertEqual(1, compile_tree(self.source, self.output, jobs=1, out=out))
+        self.assertIn('broken.haml  FAILED NameError', out.getvalue())
+
+class WatcherTest(TreeTest):
+    def test_poll(self):
+        self._write('page.haml', '%div\n  + partials/nav\n%p static')
+        watcher = Watcher(self.source, self.output, out=StringIO())
+
+        self.assertEqual(['index.haml', 'page.haml', 'partials/nav.haml'], watcher.poll())
+        self.assertEqual([], watcher.poll())
+
+        self._write('partials/nav.haml', '%ul\n  %li changed')
+        os.utime(os.path.join(self.source, 'partials/nav.haml'), (0, 0))
+        self.assertEqual(['page.haml', 'partials/nav.haml'], watcher.poll())
+        self.assertEqual('<div>\n  <ul>\n    <li>changed</li>\n  </ul>\n</div>\n<p>static</p>\n', self._read('page.html'))
+
+        self._write('index.haml', '%p= other')
+        os.utime(os.path.join(self.source, 'index.haml'), (0, 0))
+        self.assertEqual(['index.haml'], watcher.poll())
+        self.assertEqual('<p>{{other}}</p>\n', self._read('index.html'))
+
+if __name__ == '__main__':
+    unittest.main()
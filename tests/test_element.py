@@ -0,0 +1,38 @@
+import unittest
+from haiku import HAML, Tornado, Underscore
+from haiku.cache import Cache
+from haiku.element import parse_line, scan
+
+class ElementTest(unittest.TestCase):
+    def _render(self, v, target=Tornado):
+        return HAML(v, target=target, cache=Cache()).to_html()
+
+    def test_scan(self):
+        groups = scan("%a#b.c.d(x='1'){'y': 2}<>/= content")
+        self.assertEqual('%a', groups['tag'])
+        self.assertEqual('#b', groups['id'])
+        self.assertEqual('.c.d', groups['class'])
+        self.assertEqual("(x='1')", groups['attributes'])
+        self.assertEqual("{'y': 2}", groups['dict'])
+        self.assertEqual(('<', '>', '/', '='), (groups['innerstrip'], groups['outerstrip'], groups['autoclose'], groups['evaluate']))
+        self.assertEqual(' content', groups['content'])
+
+    def test_scan_brackets_run_to_last_close(self):
+        self.assertEqual("(a='(b)') (c)", scan("%p(a='(b)') (c)")['attributes'])
+        self.assertEqual('', scan('%p{a')['dict'])
+        self.assertEqual('', scan('%p.a#b')['content'])
+
+    def test_lines_are_memoized(self):
+        self.assertIs(parse_line("%li.item{'data-x': 'a&b'}"), parse_line("%li.item{'data-x': 'a&b'}"))
+
+    def test_static_attributes_are_precomputed(self):
+        line = parse_line("%p#a.b{'title': 'x<y', 'class': ['c', None]}")
+        self.assertEqual('id="a" class="b c" title="x&lt;y"', line.html)
+
+    def test_dynamic_attributes_render_per_target(self):
+        self.assertIsNone(parse_line('%p(id=name)').html)
+        self.assertEqual('<p id="{{name}}"></p>\n', self._render('%p(id=name)'))
+        self.assertEqual('<p id="<%=name%>"></p>\n', self._render('%p(id=name)', Underscore))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+from haiku import HAML, Tornado, Underscore
+from haiku.cache import Cache
+from haiku.incremental import Incremental
+
+class IncrementalTest(unittest.TestCase):
+    TEMPLATE = '\n'.join([
+        '%html',
+        '  %body',
+        '    #a',
+        '      %p= a',
+        '      %p text',
+        '    #b',
+        '      - if b',
+        '        %p b',
+        '      - else',
+        '        %p c',
+        '    #c',
+        '      %ul',
+        '        %li one',
+        '        %li two',
+    ])
+
+    def _render(self, haml, target=Tornado):
+        return HAML(haml, target=target, cache=Cache()).to_html()
+
+    def test_reuses_unchanged_blocks(self):
+        incremental = Incremental(Tornado)
+        self.assertEqual(self._render(self.TEMPLATE), incremental.render(self.TEMPLATE))
+        self.assertEqual((14, 0), (incremental.parsed, incremental.reused))
+
+        edited = self.TEMPLATE.replace('%li two', '%li three')
+        self.assertEqual(self._render(edited), incremental.render(edited))
+        self.assertEqual((5, 3), (incremental.parsed, incremental.reused))
+
+        self.assertEqual(self._render(edited), incremental.render(edited))
+        self.assertEqual((0, 1), (incremental.parsed, incremental.reused))
+
+    def test_code_blocks_follow_their_siblings(self):
+        incremental = Incremental(Tornado)
+        incremental.render(self.TEMPLATE)
+
+        edited = self.TEMPLATE.replace('      - else\n        %p c', '      %p no else')
+        self.assertEqual(self._render(edited), incremental.render(edited))
+
+    def test_compact_and_moves(self):
+        incremental = Incremental(Tornado, compact=True)
+        incremental.render(self.TEMPLATE)
+
+        edited = self.TEMPLATE.replace('    #c', '    %pre\n      #c')
+        self.assertEqual(HAML(edited, target=Tornado, cache=Cache(), compact=True).to_html(), incremental.render(edited))
+
+    def test_repeated_blocks(self):
+        incremental = Incremental(Tornado)
+        incremental.render('%p a\n%b> b')
+
+        haml = '%p a\n%b> b\n%p a\n%p a'
+        self.assertEqual(self._render(haml), incremental.render(haml))
+
+    def test_underscore_loops_stay_distinct(self):
+        incremental = Incremental(Underscore)
+        haml = '- for a in x\n  %p\n    - for b in a\n      %i= b'
+        incremental.render(haml)
+        html = incremental.render('- for c in y\n  %q\n' + haml.replace('\n', '\n  '))
+
+        self.assertEqual(3, len(set(part.split('=')[0] for part in html.split('var _i')[1:])))
+
+if __name__ == '__main__':
+    unittest.main()
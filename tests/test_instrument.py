@@ -0,0 +1,57 @@
+import unittest
+from haiku import HAML, Tornado, instrument
+from haiku.cache import Cache
+
+TEMPLATE = '%div\n  - for x in items\n    %p.item= x\n  %span #{name}\n  plain\n-# off\n  %p'
+
+class InstrumentTest(unittest.TestCase):
+    def test_disabled(self):
+        haml = HAML(TEMPLATE, target=Tornado, cache=Cache())
+
+        self.assertTrue(haml.hooks is None)
+        self.assertFalse('eval' in vars(haml.target))
+
+    def test_collector(self):
+        with instrument.collecting() as collector:
+            haml = HAML(TEMPLATE, target=Tornado, cache=Cache())
+            html = haml.to_html()
+            haml.to_html()
+
+        report = collector.report()
+        template = report['templates'][haml.sha1]
+
+        self.assertEqual(1, template['parses'])
+        self.assertEqual(1, template['renders'])
+        self.assertEqual(6, template['nodes'])
+        self.assertEqual(1, template['skipped'])
+        self.assertEqual(len(html), template['size'])
+
+        self.assertEqual(1, report['nodes']['CodeNode']['count'])
+        self.assertEqual(3, report['nodes']['HTMLNode']['count'])
+        self.assertEqual(1, report['nodes']['RawNode']['count'])
+        self.assertEqual(3, report['elements']['count'])
+        self.assertEqual(1, report['targets']['block']['count'])
+        self.assertEqual(2, report['targets']['eval']['count'])
+
+        self.assertEqual(None, instrument.active())
+        self.assertEqual(html, HAML(TEMPLATE, target=Tornado, cache=Cache()).to_html())
+
+    def test_hook(self):
+        events = []
+
+        class Hook(instrument.Hook):
+            def rendered(self, template, seconds, size):
+                events.append(('rendered', size))
+
+        hook = Hook()
+        instrument.add(hook)
+
+        try:
+            html = HAML('%p hi', cache=Cache()).to_html()
+        finally:
+            instrument.remove(hook)
+
+        self.assertEqual([('rendered', len(html))], events)
+
+if __name__ == '__main__':
+    unittest.main()
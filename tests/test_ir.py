@@ -0,0 +1,47 @@
+import marshal
+import pickle
+import unittest
+from haiku import HAML, Default, Tornado, Underscore, ir
+from haiku.cache import Cache
+
+class IRTest(unittest.TestCase):
+    TEMPLATE = '\n'.join([
+        '%ul#list{"class": "=cls"}',
+        '  - for x in items',
+        '    %li= x',
+        '  - if a and b',
+        '    %li a #{name}',
+        '  - elif not a',
+        '    %li> b',
+        '  - else',
+        '    %li c',
+        ':javascript',
+        '  var a = #{a};',
+    ])
+
+    def test_matches_direct_render(self):
+        code = ir.compile(self.TEMPLATE)
+
+        for target in (Default, Tornado, Underscore):
+            self.assertEqual(HAML(self.TEMPLATE, target=target, cache=Cache()).to_html(), ir.render(code, target))
+
+    def test_compact(self):
+        code = ir.compile(self.TEMPLATE, compact=True)
+        html = HAML(self.TEMPLATE, target=Tornado, cache=Cache(), compact=True).to_html()
+        self.assertEqual(html, ir.render(code, Tornado()))
+
+    def test_serializable(self):
+        code = ir.compile(self.TEMPLATE)
+        self.assertEqual(code, marshal.loads(marshal.dumps(code)))
+        self.assertEqual(code, pickle.loads(pickle.dumps(code, pickle.HIGHEST_PROTOCOL)))
+
+    def test_instructions(self):
+        self.assertEqual(('<p>', ('eval', 'x'), '</p>\n'), ir.compile('%p= x'))
+        self.assertEqual((('open', 'if', 'a', 'else'), 'x', ('close',), '\n', ('open', 'else', '', None), 'y', ('close',), '\n'),
+                         ir.compile('- if a\n  x\n- else\n  y'))
+
+    def test_rejects_nul(self):
+        self.assertRaises(ValueError, ir.compile, '%p \x00')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+from haiku import javascript
+from haiku.cli import bundle_tree
+
+class JavaScriptTest(unittest.TestCase):
+    def test_compile(self):
+        self.assertEqual("function(obj){var __t,__p='';with(obj||{}){__p+=\"<p>\";\n"
+                         "__p+=((__t=(a || b))==null?'':__t);\n"
+                         "__p+=\"<\\/p>\\n\";}return __p;}",
+                         javascript.compile('%p= a or b'))
+
+    def test_blocks(self):
+        source = javascript.compile('- for x in xs\n  - if x\n    %i= x\n  - else\n    %b')
+        self.assertIn('for (var _i1=0,_length1=xs.length;_i1<_length1;_i1++){var x=xs[_i1];', source)
+        self.assertIn('if (x) {', source)
+        self.assertIn('} else {', source)
+        self.assertEqual(source.count('{'), source.count('}'))
+
+    def test_bundle(self):
+        source = javascript.bundle([('a', '%p a'), ('b/c', '%p c')], name='T')
+        self.assertIn('templates["a"]=function(obj)', source)
+        self.assertIn('templates["b/c"]=function(obj)', source)
+        self.assertIn('root["T"]=templates;', source)
+
+class BundleTreeTest(unittest.TestCase):
+    def setUp(self):
+        self.source = tempfile.mkdtemp()
+
+        os.makedirs(os.path.join(self.source, 'partials'))
+
+        for name, haml in (('index.haml', '%p= name'), ('partials/nav.haml', '%ul')):
+            with open(os.path.join(self.source, name), 'w') as f:
+                f.write(haml)
+
+    def tearDown(self):
+        shutil.rmtree(self.source)
+
+    def test_bundle_tree(self):
+        output = os.path.join(self.source, 'templates.js')
+        bundle_tree(self.source, output, out=StringIO())
+
+        with open(output) as f:
+            source = f.read()
+
+        self.assertIn('templates[%s]=' % json.dumps('index'), source)
+        self.assertIn('templates[%s]=' % json.dumps('partials/nav'), source)
+
+if __name__ == '__main__':
+    unittest.main()
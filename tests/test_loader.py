@@ -0,0 +1,183 @@
+import os
+import shutil
+import tempfile
+import unittest
+from haiku import HAML, Tornado, Underscore, ir
+from haiku.cache import Cache, DiskCache
+from haiku.loader import Loader
+import haiku.loader
+
+try:
+    import tornado.template
+    from haiku.loader import TornadoLoader
+except ImportError:
+    tornado = None
+
+class LoaderTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.loader = Loader(self.root)
+
+        self._write('page.haml', '%body\n  #main\n    + nav\n  %p end')
+        self._write('nav.haml', '%ul\n  - for x in items\n    %li= x\n  + partials/item')
+        self._write('partials/item.haml', '%li\n  :plain\n    last')
+        self._write('other.haml', '%p other')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _write(self, name, haml):
+        path = os.path.join(self.root, name)
+
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        with open(path, 'w') as f:
+            f.write(haml)
+
+        # Changes within the resolution of the file system clock still count.
+        mtime = os.stat(path).st_mtime + 10
+        os.utime(path, (mtime, mtime))
+
+    def test_include_renders_as_if_nested(self):
+        inline = ('%body\n  #main\n    %ul\n      - for x in items\n        %li= x\n'
+                  '      %li\n        :plain\n          last\n  %p end')
+
+        for target in (Tornado, Underscore):
+            self.assertEqual(HAML(inline, target=target, cache=Cache()).to_html(),
+                             self.loader.load('page', target=target, cache=Cache()).to_html())
+
+    def test_include_in_ir(self):
+        html = self.loader.load('nav', target=Tornado, cache=Cache()).to_html()
+        self.assertEqual(html, ir.render(ir.compile(self.loader.read('nav'), loader=self.loader), Tornado))
+
+    def test_reuses_compiled_partials(self):
+        self.loader.load('page', cache=Cache()).to_html()
+        partials = dict(self.loader._partials)
+        self.loader.load('nav', cache=Cache()).to_html()
+
+        self.assertTrue(partials[('nav', 2, False)] is self.loader._partials[('nav', 2, False)])
+        self.assertIn(('partials/item', 1, False), self.loader._partials)
+
+    def test_dependencies(self):
+        self.loader.load('page', cache=Cache()).to_html()
+        self.assertEqual(set(['nav', 'partials/item']), self.loader.dependencies('page'))
+        self.assertEqual(set(['partials/item']), self.loader.dependencies('nav'))
+
+    def test_invalidate_drops_dependents_only(self):
+        cache = Cache()
+        page = self.loader.load('page', cache=cache)
+        other = self.loader.load('other', cache=cache)
+        page.to_html()
+        other.to_html()
+
+        self._write('partials/item.haml', '%li changed')
+        self.loader.invalidate('partials/item')
+
+        self.assertFalse(page.cache_key in cache)
+        self.assertTrue(other.cache_key in cache)
+        self.assertIn('<li>changed</li>', self.loader.load('page', cache=cache).to_html())
+
+    def test_cache_key_covers_includes(self):
+        cache = Cache()
+        page = self.loader.read('page')
+        self.assertIn('        last\n', HAML(page, cache=cache, loader=Loader(self.root)).to_html())
+
+        self._write('partials/item.haml', '%li changed')
+        self.assertIn('<li>changed</li>', HAML(page, cache=cache, loader=Loader(self.root)).to_html())
+        self.assertEqual(2, len(cache))
+
+    def test_compile_until_changed(self):
+        html = self.loader.compile('page')
+        self.assertTrue(html is self.loader.compile('page'))
+        self.assertTrue(self.loader.fresh('page'))
+
+        self._write('partials/item.haml', '%li changed')
+        self.assertFalse(self.loader.fresh('page'))
+        self.assertIn('<li>changed</li>', self.loader.compile('page'))
+        self.assertTrue(self.loader.fresh('page'))
+
+        self._write('page.haml', '%p page')
+        self.assertEqual('<p>page</p>\n', self.loader.compile('page'))
+
+    def test_compile_into_disk_cache(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        loader = Loader(self.root, cache=DiskCache(directory))
+        loader.compile('page')
+
+        self._write('partials/item.haml', '%li changed')
+        self.assertIn('<li>changed</li>', loader.compile('page'))
+
+    def test_compile_only_stats(self):
+        html = self.loader.compile('page')
+        stats = self._count_stats(self.loader)
+        hashlib, haiku.loader.hashlib = haiku.loader.hashlib, None
+
+        try:
+            self.assertTrue(html is self.loader.compile('page'))
+        finally:
+            haiku.loader.hashlib = hashlib
+
+        self.assertEqual(['nav', 'page', 'partials/item'], sorted(stats))
+
+    def _count_stats(self, loader):
+        stats = []
+        stat = loader._stat
+
+        def counted(name):
+            stats.append(name)
+            return stat(name)
+
+        loader._stat = counted
+        return stats
+
+    def test_compile_without_check(self):
+        loader = Loader(self.root, check=False)
+        html = loader.compile('page')
+        self._write('page.haml', '%p page')
+
+        self.assertTrue(loader.fresh('page'))
+        self.assertTrue(html is loader.compile('page'))
+
+        loader.invalidate('page')
+        self.assertEqual('<p>page</p>\n', loader.compile('page'))
+
+    @unittest.skipIf(tornado is None, 'tornado is not installed')
+    def test_tornado_loader(self):
+        loader = TornadoLoader(self.root)
+        self._write('list.haml', '%ul\n  - for x in items\n    %li= x')
+
+        self.assertEqual('<ul>\n<li>1</li><li>2</li>\n</ul>\n',
+                         loader.load('list').generate(items=[1, 2]).decode('utf-8'))
+
+        template = loader.load('list')
+        self.assertTrue(template is loader.load('list'))
+
+        self._write('list.haml', '%ol\n  - for x in items\n    %li= x')
+        self.assertIn(b'<ol>', loader.load('list').generate(items=[1]))
+
+    @unittest.skipIf(tornado is None, 'tornado is not installed')
+    def test_tornado_loader_includes(self):
+        loader = TornadoLoader(self.root)
+        stats = self._count_stats(loader.haiku)
+        loader.load('page')
+        self.assertEqual(['nav', 'page', 'partials/item'], sorted(stats))
+
+        self._write('other.haml', '%p\n  + partials/item')
+        loader.load('other')
+        self._write('partials/item.haml', '%li changed')
+
+        # The change is noticed through page, but other is stale too.
+        self.assertIn(b'<li>changed</li>', loader.load('page').generate(items=[]))
+        self.assertIn(b'<li>changed</li>', loader.load('other').generate())
+
+    def test_errors(self):
+        self._write('loop.haml', '%p\n  + loop')
+        self.assertRaises(ValueError, self.loader.load('loop', cache=Cache()).to_html)
+        self.assertRaises(ValueError, self.loader.resolve, '../outside')
+        self.assertRaises(ValueError, HAML('+ nav', cache=Cache()).to_html)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+import unittest
+from haiku.native import Template, generate
+
+class TemplateTest(unittest.TestCase):
+    def test_evaluation_is_escaped(self):
+        template = Template('%p{"title": "=title"}= body\n%a #{link}')
+        self.assertEqual('<p title="a&quot;b">&lt;b&gt; &amp;</p>\n<a>x</a>\n',
+                         template.render({'title': 'a"b', 'body': '<b> &'}, link='x'))
+
+    def test_for(self):
+        template = Template('%ul\n  - for x in items\n    %li= x')
+        self.assertEqual('<ul>\n<li>1</li><li>2</li>\n</ul>\n', template.render(items=[1, 2]))
+        self.assertEqual('<ul>\n\n</ul>\n', template.render(items=[]))
+
+    def test_if(self):
+        template = Template('- if a\n  a\n- elif b\n  b\n- else\n  c\n%p end')
+
+        self.assertEqual('a\n\n<p>end</p>\n', template.render(a=1, b=0))
+        self.assertEqual('b\n\n<p>end</p>\n', template.render(a=0, b=1))
+        self.assertEqual('c\n<p>end</p>\n', template.render(a=0, b=0))
+
+    def test_set(self):
+        self.assertEqual('\n<p>3</p>\n', Template('- set n = len(items)\n%p= n').render(items='abc'))
+
+    def test_unicode(self):
+        template = Template(u'%p é #{name}'.encode('utf-8'))
+        self.assertEqual(u'<p>é ü</p>\n'.encode('utf-8'), template.render(name=u'ü'))
+        self.assertEqual('<p>\xc3\xa9 </p>\n', template.render(name=None))
+
+    def test_generate(self):
+        source = generate((('open', 'if', 'a', 'else'), 'x', ('close',), ('open', 'else', '', None), 'y', ('close',)))
+        self.assertIn('    if a:\n', source)
+        self.assertIn('    else:\n', source)
+        compile(source, '<test>', 'exec')
+
+if __name__ == '__main__':
+    unittest.main()
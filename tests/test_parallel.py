@@ -0,0 +1,53 @@
+import multiprocessing
+import unittest
+from haiku import HAML, Tornado, Underscore, parallel
+from haiku.cache import Cache
+
+class ParallelTest(unittest.TestCase):
+    TEMPLATE = '\n'.join([
+        '!!! 5',
+        '%a first',
+        '%div.a',
+        '  - for x in items',
+        '    %p= x',
+        '- if a',
+        '  %p a',
+        '- else',
+        '  %p b',
+        '%div.b',
+        '  :plain',
+        '    text',
+        '',
+        '%span> stripped',
+        '%p after',
+        '%p multi |',
+        '  line |',
+        '%ul',
+        '  - for y in x',
+        '    %li= y',
+        '%div.c #{z}',
+    ])
+
+    @classmethod
+    def setUpClass(cls):
+        cls.pool = multiprocessing.Pool(2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.close()
+        cls.pool.join()
+
+    def test_split(self):
+        chunks = [chunk.split('\n')[0] for chunk, _ in parallel.split(self.TEMPLATE, 1)]
+        self.assertEqual(['!!! 5', '%div.a', '%div.c #{z}'], chunks)
+        self.assertEqual([False, False, True], [joined for _, joined in parallel.split(self.TEMPLATE, 1)])
+        self.assertEqual(1, len(parallel.split(self.TEMPLATE, 100)))
+
+    def test_same_output(self):
+        for target in (Tornado, Underscore):
+            for compact in (False, True):
+                self.assertEqual(HAML(self.TEMPLATE, target=target, cache=Cache(), compact=compact).to_html(),
+                                 parallel.render(self.TEMPLATE, target, compact, size=1, pool=self.pool))
+
+if __name__ == '__main__':
+    unittest.main()
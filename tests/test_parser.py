@@ -0,0 +1,171 @@
+import hashlib
+import os
+import tempfile
+import unittest
+from haiku import HAML, Tornado, Underscore
+from haiku import node
+from haiku.cache import Cache
+from haiku.parser import MappedSource, Source, parse, tokenize
+
+class ParserTest(unittest.TestCase):
+    def _render(self, v):
+        return HAML(v, target=Tornado).to_html()
+
+    def test_tokenize_skips_empty_lines(self):
+        self.assertEqual([(1, 0, '%p'), (3, 2, '  foo'), (4, 1, '\tbar')], list(tokenize(Source('%p\n\n  foo\n\tbar'))))
+
+    def test_multiline(self):
+        self.assertEqual('<p>foo bar baz</p>\n<q>next</q>\n', self._render('%p foo |\n  bar |\n  baz |\n%q next'))
+
+    def test_multiline_does_not_escape_its_block(self):
+        self.assertEqual('<p>\n  foo\n</p>\nbar\n', self._render('%p\n  foo |\nbar |'))
+
+    def test_multiline_nests_by_first_line(self):
+        self.assertEqual('<div>\n  foo bar\n  <p></p>\n</div>\n', self._render('%div\n    foo |\n  bar |\n  %p'))
+
+    def test_filter_keeps_raw_lines(self):
+        self.assertEqual('<p>\n  a |\n    %b\n</p>\n', self._render('%p\n  :plain\n    a |\n      %b'))
+
+    def test_deep_nesting(self):
+        depth = 2000
+        node = parse(None, '\n'.join(' ' * i + '%i' for i in range(depth)))
+
+        for i in range(depth):
+            self.assertEqual(1, len(node.children))
+            node = node.children[0]
+            self.assertEqual(i, node.indentation)
+
+    def test_get_sibling(self):
+        root = parse(None, '%a\n%b\n%c')
+        a, b, c = root.children
+        self.assertIs(a, b.get_sibling(-1))
+        self.assertIs(c, b.get_sibling(1))
+        self.assertIs(c, a.get_sibling(2))
+        self.assertIsNone(a.get_sibling(-1))
+        self.assertIsNone(c.get_sibling(1))
+        self.assertIsNone(b.get_sibling(0))
+
+    def test_nodes_have_no_dict(self):
+        root = parse(None, '%p\n  - if a\n    :plain\n      x')
+        self.assertFalse(hasattr(root.children[0].children[0], '__dict__'))
+        self.assertFalse(hasattr(root.children[0].children[0].children[0], '__dict__'))
+
+    def test_filter_references_source_span(self):
+        node = parse(None, '%p\n  :plain\n    a\n\n    b\n\n%q').children[0].children[0]
+        self.assertEqual((2, 5), node.span)
+        self.assertEqual(['    a', '    b'], node.nested_haml)
+
+    def test_classify(self):
+        self.assertIs(node.HAMLComment, node.Node.classify('-# x'))
+        self.assertIs(node.CodeNode, node.Node.classify('- if x'))
+        self.assertIs(node.EvalNode, node.Node.classify('>= x'))
+        self.assertIs(node.RawNode, node.Node.classify('> x'))
+        self.assertIs(node.RawNode, node.Node.classify(''))
+        self.assertIs(node.EscapedFilterNode, node.Node.classify(':escaped'))
+
+    def test_register(self):
+        registered = dict(node._NODES)
+
+        @node.register(':upper')
+        class UpperFilterNode(node.PlainFilterNode):
+            __slots__ = ()
+
+            def iter_html(self):
+                for chunk in self._iter_lines():
+                    yield chunk.upper()
+
+        try:
+            self.assertEqual('<p>\n  abc\n</p>\n', self._render('%p\n  :upper\n    abc'.replace('upper', 'plain')))
+            self.assertEqual('<p>\n  ABC\n</p>\n', self._render('%p\n  :upper\n    abc'))
+        finally:
+            node._NODES.clear()
+            node._NODES.update(registered)
+
+class FoldTest(unittest.TestCase):
+    TEMPLATE = '%div\n  %ul\n    %li a\n    %li= b\n  %p\n    static #{c}\n  %p\n    %a{"href": "/"} x\n:plain\n  #{d}'
+
+    def _haml(self, v, target=Tornado):
+        return HAML(v, target=target, cache=Cache())
+
+    def test_folds_largest_static_subtrees(self):
+        root = self._haml(self.TEMPLATE).node
+        div = root.children[0]
+        ul, p, static_p = div.children
+
+        self.assertEqual(None, div.fragment)
+        self.assertEqual(None, ul.fragment)
+        self.assertEqual('    <li>a</li>', ul.children[0].fragment)
+        self.assertEqual(None, p.fragment)
+        self.assertEqual('  <p>\n    <a href="/">x</a>\n  </p>', static_p.fragment)
+        self.assertEqual(None, static_p.children[0].fragment)
+        self.assertEqual('#{d}', root.children[1].fragment)
+
+    def test_matches_unfolded_render(self):
+        for compact in (False, True):
+            folded = HAML(self.TEMPLATE, target=Tornado, cache=Cache(), compact=compact)
+            unfolded = HAML(self.TEMPLATE, target=Tornado, cache=Cache(), compact=compact)
+            unfolded._node = parse(unfolded, self.TEMPLATE)
+            self.assertEqual(unfolded.to_html(), folded.to_html())
+
+    def test_interns_fragments(self):
+        nav = '%ul\n  %li a\n  %li b\n'
+        first = self._haml(nav + '%p= x').node.children[0].fragment
+        second = self._haml(nav + '%p= y', target=Underscore).node.children[0].fragment
+        self.assertTrue(first is second)
+
+        nested = self._haml('%div\n  - if a\n    ' + nav.replace('\n', '\n    ')).node
+        self.assertFalse(nested.children[0].children[0].children[0].fragment is first)
+
+class SkipTest(unittest.TestCase):
+    TEMPLATE = '%p a\n-# debug\n  %div\n    - for x in y\n\n      %p= x |\n  :plain\n    raw\n%p b'
+
+    def test_comment_bodies_are_skipped(self):
+        haml = HAML(self.TEMPLATE, target=Tornado, cache=Cache())
+
+        self.assertEqual('<p>a</p>\n<p>b</p>\n', haml.to_html())
+        self.assertEqual({'nodes': 3, 'skipped': 5}, haml.parse_stats)
+        self.assertEqual([], haml.node.children[1].children)
+
+    def test_static_subtree_with_comment(self):
+        self.assertEqual('<div>\n  <p>a</p>\n\n</div>\n',
+                         HAML('%div\n  %p a\n  -# x\n    y', cache=Cache()).to_html())
+
+class MappedSourceTest(unittest.TestCase):
+    TEMPLATE = '%div\n  %p= a\n\n  :plain\n    one\n\n    two\n%p end\n'
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.haml')
+
+        with os.fdopen(fd, 'wb') as f:
+            f.write(self.TEMPLATE)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def test_lines(self):
+        source = MappedSource(self.path)
+
+        self.assertEqual(self.TEMPLATE.split('\n'), list(source.lines))
+        self.assertEqual(self.TEMPLATE.split('\n')[2:5], source.lines[2:5])
+        self.assertEqual(['    one', '    two'], source.get_lines(4, 7))
+        self.assertEqual(hashlib.sha1(self.TEMPLATE).hexdigest(), source.sha1)
+
+    def test_from_path(self):
+        cache = Cache()
+        template = HAML.from_path(self.path, target=Tornado, cache=cache)
+
+        self.assertEqual(HAML(self.TEMPLATE, target=Tornado).cache_key, template.cache_key)
+        self.assertEqual(HAML(self.TEMPLATE, target=Tornado, cache=Cache()).to_html(), template.to_html())
+
+        hit = HAML.from_path(self.path, target=Tornado, cache=cache)
+        self.assertEqual(template.to_html(), hit.to_html())
+        self.assertTrue(hit._node is None)
+
+    def test_empty_file(self):
+        with open(self.path, 'wb'):
+            pass
+
+        self.assertEqual('', HAML.from_path(self.path, cache=Cache()).to_html())
+
+if __name__ == '__main__':
+    unittest.main()
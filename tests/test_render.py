@@ -0,0 +1,105 @@
+import unittest
+from StringIO import StringIO
+from haiku import HAML, Tornado
+from haiku.cache import Cache
+
+class StreamingTest(unittest.TestCase):
+    TEMPLATES = [
+        '',
+        '%ul\n  %li> a\n  %li b\n  %li> c\n  %li d',
+        '%p\n  foo\n  > bar\n  baz',
+        '%p<\n  inner\n  %a x\n%div<= val',
+        '/ a comment\n/\n  %p inside\n/[if IE]\n  %p ie',
+        '- for x in items\n  %li= x #{x}\n- if a\n  %p a\n- else\n  %p c',
+        '%p\n  :escaped\n    <b>\n:javascript\n  var a;',
+        '%p\n  %a> x\n  -# c',
+    ]
+
+    def _haml(self, v):
+        return HAML(v, target=Tornado, cache=Cache())
+
+    def test_iter_html_matches_to_html(self):
+        for template in self.TEMPLATES:
+            self.assertEqual(self._haml(template).to_html(), ''.join(self._haml(template).iter_html()))
+
+    def test_iter_html_yields_chunks(self):
+        self.assertTrue(len(list(self._haml('%ul\n  %li a\n  %li b').iter_html())) > 1)
+
+    def test_write_to(self):
+        f = StringIO()
+        self._haml('%p\n  %a x').write_to(f)
+        self.assertEqual('<p>\n  <a>x</a>\n</p>\n', f.getvalue())
+
+    def test_outerstrip(self):
+        self.assertEqual('<ul>\n<li>a</li><li>b</li><li>c</li><li>d</li>\n</ul>\n',
+                         self._haml('%ul\n  %li> a\n  %li b\n  %li> c\n  %li d').to_html())
+        self.assertEqual('<p>\n  foobarbaz\n</p>\n', self._haml('%p\n  foo\n  > bar\n  baz').to_html())
+
+    def test_innerstrip(self):
+        self.assertEqual('<p>inner\n  <a>x</a></p>\n', self._haml('%p<\n  inner\n  %a x').to_html())
+
+    def test_comment_after_outerstrip(self):
+        self.assertEqual('<p>\n<a>x</a>\n</p>\n', self._haml('%p\n  %a> x\n  -# c').to_html())
+        self.assertEqual('<div>\n<span>x</span><span>y</span>\n</div>\n',
+                         self._haml('%div\n  %span> x\n  -# c\n  %span y').to_html())
+
+    def test_outerstrip_is_resolved_when_parsing(self):
+        haml = self._haml('%p\n  foo\n  > bar\n  %a{"href": "=url"} baz\n  %b> q')
+        foo, bar, a, b = haml.node.children[0].children
+
+        self.assertEqual([2, 3, 3, 3], [foo.whitespace, bar.whitespace, a.whitespace, b.whitespace])
+        self.assertEqual('<p>\n  foobar<a href="{{url}}">baz</a><b>q</b>\n</p>\n', haml.to_html())
+
+class InterpolationTest(unittest.TestCase):
+    def _render(self, v):
+        return HAML(v, target=Tornado, cache=Cache()).to_html()
+
+    def test_text(self):
+        self.assertEqual('hello {{a}} and {{b}}\n', self._render('hello #{a} and #{b}'))
+        self.assertEqual('<p>\n  {{a}}\n</p>\n', self._render('%p\n  \\#{a}'))
+        self.assertEqual('#{unclosed\n', self._render('#{unclosed'.join(['\\', ''])))
+
+    def test_element(self):
+        self.assertEqual('<p>x {{a}}</p>\n', self._render('%p x #{a}'))
+        self.assertEqual('<a href="/{{url}}">l</a>\n', self._render("%a{'href': '/#{url}'} l"))
+        self.assertEqual('<p>{{"#{a}"}}</p>\n', self._render('%p= "#{a}"'))
+
+    def test_comments(self):
+        self.assertEqual('<!-- {{a}} -->\n', self._render('/ #{a}'))
+
+    def test_filters(self):
+        self.assertEqual('#{a}\n', self._render(':plain\n  #{a}'))
+        self.assertEqual('#{a} &amp;\n', self._render(':escaped\n  #{a} &'))
+        self.assertEqual('//<![CDATA[\n{{a}}\n//]]>\n', self._render(':cdata\n  #{a}'))
+
+    def test_empty_filters(self):
+        self.assertEqual('//<![CDATA[\n//]]>\n', self._render(':cdata'))
+        self.assertEqual('<script type="text/javascript">\n  //<![CDATA[\n  //]]>\n</script>\n', self._render(':javascript'))
+        self.assertEqual('<p>\n  <style type="text/css">\n    //<![CDATA[\n    //]]>\n  </style>\n</p>\n',
+                         self._render('%p\n  :css'))
+
+class CompactTest(unittest.TestCase):
+    def _render(self, v, cache=None):
+        return HAML(v, target=Tornado, cache=cache or Cache(), compact=True).to_html()
+
+    def test_blocks(self):
+        self.assertEqual('<div id="a"><ul><li>a</li><li>b</li></ul></div>\n',
+                         self._render('#a\n  %ul\n    %li a\n    %li b'))
+
+    def test_inline_whitespace(self):
+        self.assertEqual('<p>hello\n<a>x</a>\nworld</p>\n', self._render('%p hello\n  %a x\n  world'))
+        self.assertEqual('<span>\n<b>x</b>\n</span>\n', self._render('%span\n  %b x'))
+
+    def test_preserve(self):
+        self.assertEqual('<div><pre>\n    a\n    <b>b</b>\n  </pre></div>\n',
+                         self._render('%div\n  %pre\n    a\n    %b b'))
+        self.assertEqual('<form><textarea>\n    x\n  </textarea></form>\n', self._render('%form\n  %textarea\n    x'))
+        self.assertEqual('<div>    a\n      b</div>\n', self._render('%div\n  :plain\n      a\n        b'))
+
+    def test_cache_key(self):
+        cache = Cache()
+        self.assertEqual('<ul><li>a</li></ul>\n', self._render('%ul\n  %li a', cache))
+        self.assertEqual('<ul>\n  <li>a</li>\n</ul>\n', HAML('%ul\n  %li a', target=Tornado, cache=cache).to_html())
+
+if __name__ == '__main__':
+    unittest.main()
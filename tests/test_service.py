@@ -0,0 +1,151 @@
+import threading
+import time
+import unittest
+import haiku
+from haiku import HAML, Tornado, Underscore, instrument
+from haiku.cache import Cache
+from haiku.service import CompileService
+
+try:
+    from tornado import gen
+    from tornado.ioloop import IOLoop
+    from tornado.util import TimeoutError
+except ImportError:
+    IOLoop = None
+
+class Slow(Tornado):
+    def eval(self, input):
+        time.sleep(0.01)
+        return Tornado.eval(self, input)
+
+class CompileServiceTest(unittest.TestCase):
+    def setUp(self):
+        self.service = CompileService(Tornado)
+
+    def tearDown(self):
+        self.service.close()
+
+    def test_compile(self):
+        haml = '%ul\n  - for x in items\n    %li= x'
+        html = self.service.compile(haml)
+
+        self.assertEqual(HAML(haml, target=Tornado, cache=Cache()).to_html(), html)
+        self.assertTrue(html is self.service.compile(haml))
+        self.assertEqual(HAML(haml, target=Underscore, cache=Cache()).to_html(),
+                         self.service.compile(haml, target=Underscore))
+
+    def test_concurrent_compiles_are_shared(self):
+        haml = '%p= a\n%p= b\n%p= c'
+        results = []
+
+        def compile():
+            results.append(self.service.compile(haml, target=Slow))
+
+        with instrument.collecting() as collector:
+            threads = [threading.Thread(target=compile) for _ in range(8)]
+
+            for thread in threads:
+                thread.start()
+
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(3, collector.report()['targets']['eval']['count'])
+        self.assertEqual(set(['<p>{{a}}</p>\n<p>{{b}}</p>\n<p>{{c}}</p>\n']), set(results))
+        self.assertEqual(8, len(results))
+
+    def test_compile_landing_after_a_miss(self):
+        html = self.service.compile('%p= a')
+        get = self.service.cache.get
+        misses = [None]
+
+        # As if the cache was looked at just before another compile landed.
+        self.service.cache.get = lambda key: misses.pop() if misses else get(key)
+
+        with instrument.collecting() as collector:
+            self.assertTrue(html is self.service.compile('%p= a'))
+
+        self.assertEqual({}, collector.report()['targets'])
+
+    def test_compile_many(self):
+        templates = ['- for x in y%d\n  %%p= x' % (i % 5) for i in range(20)]
+        expected = [HAML(haml, target=Underscore, cache=Cache()).to_html() for haml in templates]
+
+        self.assertEqual(expected, self.service.compile_many(templates, target=Underscore))
+
+    def test_errors_reach_every_caller(self):
+        self.assertRaises(ValueError, self.service.compile, '+ partial')
+        self.assertEqual({}, self.service._flights)
+
+@unittest.skipIf(IOLoop is None, 'tornado is not installed')
+class CompileAsyncTest(unittest.TestCase):
+    def setUp(self):
+        self.io_loop = IOLoop()
+        self.io_loop.make_current()
+        self.service = CompileService(Tornado)
+
+    def tearDown(self):
+        self.io_loop.clear_current()
+        self.io_loop.close()
+
+    def _run(self, coroutine):
+        return self.io_loop.run_sync(gen.coroutine(coroutine))
+
+    def test_concurrent_calls_share_one_compile(self):
+        def compile():
+            futures = [self.service.compile_async('%p= a', target=Slow) for _ in range(4)]
+            self.assertEqual(1, len(self.service._futures))
+            results = yield futures
+            raise gen.Return(results)
+
+        with instrument.collecting() as collector:
+            self.assertEqual(['<p>{{a}}</p>\n'] * 4, self._run(compile))
+
+        self.assertEqual(1, collector.report()['targets']['eval']['count'])
+        self.assertEqual({}, self.service._futures)
+        self.assertEqual('<p>{{a}}</p>\n', self.service.cache.get(HAML('%p= a', target=Slow).cache_key))
+
+    def test_timeout_keeps_the_shared_compile(self):
+        haml = '\n'.join('%%p= v%d' % i for i in range(10))
+
+        def compile():
+            with self.assertRaises(TimeoutError):
+                yield self.service.compile_async(haml, target=Slow, timeout=0.001)
+
+            # The compile goes on, and later calls wait for it.
+            self.assertEqual(1, len(self.service._futures))
+            html = yield self.service.compile_async(haml, target=Slow)
+            raise gen.Return(html)
+
+        expected = HAML(haml, target=Tornado, cache=Cache()).to_html()
+
+        with instrument.collecting() as collector:
+            self.assertEqual(expected, self._run(compile))
+
+        self.assertEqual(10, collector.report()['targets']['eval']['count'])
+
+    def test_compile_many_async(self):
+        templates = ['%p a', '%p= b', '%p a']
+
+        def compile():
+            results = yield self.service.compile_many_async(templates, target=Underscore)
+            raise gen.Return(results)
+
+        self.assertEqual([HAML(haml, target=Underscore, cache=Cache()).to_html() for haml in templates], self._run(compile))
+
+    def test_shared_service(self):
+        def compile():
+            html = yield haiku.compile_async('%p= a', target=Underscore)
+            raise gen.Return(html)
+
+        self.assertEqual('<p><%=a%></p>\n', self._run(compile))
+
+    def test_errors(self):
+        def compile():
+            yield self.service.compile_async('+ partial')
+
+        self.assertRaises(ValueError, self._run, compile)
+        self.assertEqual({}, self.service._futures)
+
+if __name__ == '__main__':
+    unittest.main()